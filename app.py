@@ -1,22 +1,78 @@
-from dash.dependencies import Input, Output
+from dash.dependencies import ClientsideFunction, Input, Output, State
 
+import argparse
+import glob
+import hashlib
+import hmac
+import json
 import os
+import re
+import sys
 import time
-from flask_caching import Cache
-from flask import redirect, request
+import traceback
+from flask_compress import Compress
+from flask import abort, has_request_context, redirect, request, send_file, send_from_directory
 from urllib.parse import urlparse, urlunparse
 
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
+import plotly
+from dash.exceptions import PreventUpdate
 
+from plots.geometry import GEOMETRY_DIR, GEOMETRY_LEVELS, geometry_path, missing_geometry_levels
+from plots.metrics import (
+    CALLBACK_SECONDS,
+    PAYLOAD_BUILD_SECONDS,
+    PAYLOAD_LOOKUPS,
+    PAYLOAD_MISSES,
+    WORKER_STARTUP_SECONDS,
+    metrics_response
+)
+from plots.payloads import make_json_payload, make_payload
 from plots.plotly_figs import PlotlyFigs
+from plots.refresher import BackgroundRefresher
+from plots.static_export import StaticFigureStore, static_name
+from plots.tiered_cache import TieredCache
+from plots.tracing import SamplingProfiler, finish_trace, server_timing, start_trace
 
 from metadata.states import STATE_MAPPING, STATE_POP
 
 TIMEOUT = 3600
 
-app = dash.Dash(__name__)
+# seconds between revalidations of the upstream data; figures are rebuilt
+# only when the data they read has changed
+UPSTREAM_POLL_INTERVAL = int(os.environ.get('UPSTREAM_POLL_INTERVAL', 300))
+CACHE_DIR = os.environ.get('CACHE_DIR', 'cache-directory')
+CACHE_MEMORY_BYTES = int(os.environ.get('CACHE_MEMORY_BYTES', 64 * 2 ** 20))
+CACHE_DISK_BYTES = int(os.environ.get('CACHE_DISK_BYTES', 512 * 2 ** 20))
+SNAPSHOT_DIR = 'snapshot-directory'
+PROFILE_DIR = 'profile-directory'
+# absolute, since Flask resolves relative paths it sends against the app
+# package rather than the working directory
+STATIC_DIR = os.path.abspath(os.environ.get('STATIC_FIGURE_DIR', 'static-figure-directory'))
+
+# 'master' when an exporter started by gunicorn's master builds every
+# figure for the workers to serve read-only (see gunicorn.conf.py); workers
+# then never load the dataset or build figures themselves. With 'worker'
+# each worker keeps its own figures fresh and ignores any exported store
+FIGURE_BUILDER = os.environ.get('FIGURE_BUILDER', 'worker')
+
+TAB_VALUES = ['us', 'states', 'maps']
+
+# code whose changes alter the responses; hashed into every cache key
+CODE_VERSION_SOURCES = ['app.py', 'plots/*.py', 'metadata/*.py']
+
+# set by gunicorn's post_fork hook; a worker started any other way is
+# timed from this import
+WORKER_STARTED_AT = float(os.environ.get('WORKER_STARTED_AT', time.time()))
+
+# relayoutData key of the start of a zoomed x range, e.g. 'xaxis3.range[0]'
+RELAYOUT_RANGE = re.compile(r'^xaxis(\d*)\.range\[0\]$')
+
+LOADING_MESSAGE = "The latest data is still loading, please refresh in a moment."
+
+app = dash.Dash(__name__, compress=False)
 
 app.index_string = '''
 <!DOCTYPE html>
@@ -44,6 +100,63 @@ app.config.suppress_callback_exceptions = True
 
 server = app.server
 
+profiler = SamplingProfiler(PROFILE_DIR)
+
+@server.before_first_request
+def record_startup_time():
+    WORKER_STARTUP_SECONDS.observe(time.time() - WORKER_STARTED_AT)
+
+@server.before_request
+def start_request_trace():
+    start_trace()
+    if not request.path.startswith('/admin/'):
+        profiler.begin_request()
+
+@server.after_request
+def finish_request_trace(response):
+    trace = finish_trace()
+    if trace:
+        response.headers['Server-Timing'] = server_timing(trace)
+    profiler.end_request()
+    return response
+
+@server.route('/admin/profile', methods=['GET', 'POST'])
+def admin_profile():
+    """
+    POST ?requests=N samples the next N requests handled by whichever
+    worker picks them up; GET lists the captures of every worker, newest
+    first, and GET ?name=<capture> returns one as collapsed stacks for
+    flamegraph.pl or speedscope. Disabled unless ADMIN_TOKEN is set.
+    """
+    token = os.environ.get('ADMIN_TOKEN')
+    if not token or not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token):
+        abort(404)
+    if request.method == 'POST':
+        requests_to_profile = request.args.get('requests', 10, type=int)
+        profiler.request(requests_to_profile)
+        return 'profiling the next {} requests\n'.format(requests_to_profile)
+    name = request.args.get('name')
+    if name is None:
+        return ''.join(capture + '\n' for capture in profiler.captures()), 200, {'Content-Type': 'text/plain'}
+    if name not in profiler.captures():
+        abort(404)
+    return send_file(os.path.abspath(os.path.join(PROFILE_DIR, name)), mimetype='text/plain')
+
+MISSING_GEOMETRY_LEVELS = missing_geometry_levels()
+if MISSING_GEOMETRY_LEVELS:
+    # every map's outlines would 404 and the maps render empty
+    server.logger.error(
+        'State outlines missing from %s for levels %s, run `python -m plots.geometry` (bin/post_compile)',
+        GEOMETRY_DIR, ', '.join(MISSING_GEOMETRY_LEVELS)
+    )
+
+@server.route('/geo/us-states-<level>.json')
+def serve_geometry(level):
+    if level not in GEOMETRY_LEVELS:
+        abort(404)
+    # generated at build time by bin/post_compile; a missing file is a 404
+    return send_from_directory(GEOMETRY_DIR, os.path.basename(geometry_path(level)), cache_timeout=TIMEOUT * 24)
+
 app.layout = html.Div(
     [
         html.Br(),
@@ -75,30 +188,80 @@ app.layout = html.Div(
     className="container"
 )
 
-cache = Cache(app.server, config={
-    'CACHE_TYPE': 'filesystem',
-    'CACHE_DIR': 'cache-directory'
-})
+cache = TieredCache(CACHE_DIR, memory_bytes=CACHE_MEMORY_BYTES, disk_bytes=CACHE_DISK_BYTES)
+
+Compress(server)
 
-plotly_figs = PlotlyFigs(STATE_MAPPING, STATE_POP)
+plotly_figs = PlotlyFigs(STATE_MAPPING, STATE_POP, snapshot_dir=SNAPSHOT_DIR)
 
-@cache.memoize(timeout=TIMEOUT)
 def make_bar_figures(region):
     return plotly_figs.make_bar_figures(region)
 
-@cache.memoize(timeout=TIMEOUT)
-def make_map_figures():
-    return plotly_figs.make_map_figures()
+def dataset_available():
+    """
+    Whether callbacks may build figures from plotly_figs here. Exports and
+    the background refresher may download; a request only builds in
+    worker mode from data this worker holds or its local snapshot, so
+    requests never download and master-mode workers never load a dataset.
+    """
+    if not has_request_context():
+        return True
+    return FIGURE_BUILDER == 'worker' and plotly_figs.dataset.load_snapshot()
 
-@cache.memoize(timeout=TIMEOUT)
-def make_state_growth_plots():
-    return plotly_figs.make_state_growth_plots()
+def relayout_zoom(relayout_data):
+    """
+    (axis, start, end) of the x range a relayout event zoomed to, or None.
+    """
+    for key, start in (relayout_data or {}).items():
+        match = RELAYOUT_RANGE.match(key)
+        if match:
+            end = relayout_data.get('xaxis{}.range[1]'.format(match.group(1)))
+            if end is not None:
+                return 'x' + match.group(1), start, end
+    return None
 
-state_growth_fig, state_growth_fig_per_capita = make_state_growth_plots()
+def make_zoomed_bar_figures(region, relayout_data):
+    """
+    Rebuild a bar figure at full resolution within the range a user zoomed
+    to, or at overview resolution when the axes are reset. Other relayout
+    events (resizes, y-only zooms) leave the figure as it is.
+    """
+    zoom = relayout_zoom(relayout_data)
+    if zoom is None and not any(key.endswith('autorange') for key in (relayout_data or {})):
+        raise PreventUpdate
+    if FIGURE_BUILDER == 'worker':
+        if not dataset_available():
+            raise PreventUpdate
+        return plotly_figs.make_bar_figures(region, zoom=zoom)
+    # workers serving an export build from the series exported with it,
+    # without loading the dataset
+    bar_series = load_bar_series(region)
+    if bar_series is None:
+        raise PreventUpdate
+    return plotly_figs.make_bar_figures_from_series(bar_series, zoom=zoom)
+
+def load_bar_series(region):
+    """
+    The exported bar_series() of a region, or None if there is none.
+    """
+    found = static_figures.lookup(static_name('bar-series', region), ())
+    if found is None:
+        return None
+    try:
+        with open(found[0]) as f:
+            return json.load(f)
+    except OSError:
+        # pruned by a newer export since the lookup
+        return None
+
+def make_map_figures():
+    return plotly_figs.make_map_figures()
 
 @app.callback(Output('tabs-content', 'children'),
               [Input('tabs-covid', 'value')])
 def render_content(tab):
+    if tab not in TAB_VALUES or not dataset_available():
+        raise PreventUpdate
     if tab == 'us':
         return html.Div([
             dcc.Graph(id='graph-us',figure=make_bar_figures('US')),
@@ -107,6 +270,7 @@ def render_content(tab):
             ]),
         ])
     elif tab == 'states':
+        state_growth_fig, state_growth_fig_per_capita = plotly_figs.make_state_growth_plots()
         content = html.Div([
             html.Label("State",form="stateForm",className="app__dropdown"),
             html.Div(
@@ -137,34 +301,267 @@ def render_content(tab):
                 )
             ],
             id="yaxis-type-div"),
-            dcc.Graph(id='state-growth'),
-            dcc.Graph(id='state-capita'),
+            dcc.Graph(id='state-growth', figure=state_growth_fig),
+            dcc.Graph(id='state-capita', figure=state_growth_fig_per_capita),
+            dcc.Graph(id='state-trends', figure=plotly_figs.make_trend_comparison()),
         ])
         return content
     elif tab == 'maps':
         return make_map_figures()
 
-@app.callback(Output("state-growth", "figure"), [Input("yaxis-type", "value")])
-def update_state_growth_fig(value):
-    if value == 'Linear':
-        yaxis_type = 'linear'
-    else:
-        yaxis_type = 'log'
-    state_growth_fig.update_yaxes(type=yaxis_type)
-    return state_growth_fig
-
-@app.callback(Output("state-capita", "figure"), [Input("yaxis-type", "value")])
-def update_state_growth_fig(value):
-    if value == 'Linear':
-        yaxis_type = 'linear'
-    else:
-        yaxis_type = 'log'
-    state_growth_fig_per_capita.update_yaxes(type=yaxis_type)
-    return state_growth_fig_per_capita
+# the axis type is flipped in the browser (assets/clientside.js) on the
+# figures sent with the states tab, so toggling never reaches the server
+app.clientside_callback(
+    ClientsideFunction(namespace='axes', function_name='set_yaxis_type'),
+    Output("state-growth", "figure"),
+    [Input("yaxis-type", "value")],
+    [State("state-growth", "figure")]
+)
+
+app.clientside_callback(
+    ClientsideFunction(namespace='axes', function_name='set_yaxis_type'),
+    Output("state-capita", "figure"),
+    [Input("yaxis-type", "value")],
+    [State("state-capita", "figure")]
+)
 
-@app.callback(Output("state-graphs", "figure"), [Input("state_dropdown", "value")])
-def make_figure(value):
+@app.callback(Output("state-graphs", "figure"), [Input("state_dropdown", "value"), Input("state-graphs", "relayoutData")])
+def make_figure(value, relayout_data=None):
+    # a cleared dropdown sends None
+    if value not in STATE_MAPPING:
+        raise PreventUpdate
+    if relayout_data is not None and dash.callback_context.triggered[0]['prop_id'] == 'state-graphs.relayoutData':
+        return make_zoomed_bar_figures(value, relayout_data)
+    if not dataset_available():
+        raise PreventUpdate
     return make_bar_figures(value)
 
-if __name__ == '__main__':
+@app.callback(Output("graph-us", "figure"), [Input("graph-us", "relayoutData")])
+def zoom_us_figure(relayout_data):
+    return make_zoomed_bar_figures('US', relayout_data)
+
+# callback output -> (undecorated callback, input values whose responses are
+# cached); Dash's decorator returns a wrapper that serializes the result
+PAYLOAD_CALLBACKS = {
+    'tabs-content.children': (render_content.__wrapped__, TAB_VALUES),
+    'state-graphs.figure': (make_figure.__wrapped__, list(STATE_MAPPING))
+}
+
+PAYLOAD_JOBS = [(output, value) for output, (_, values) in PAYLOAD_CALLBACKS.items() for value in values]
+
+def code_version():
+    """
+    Hash of the sources and library versions that shape a response, so
+    responses cached or exported by a previous deploy are never reused.
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha1()
+    digest.update(' '.join([dash.__version__, plotly.__version__]).encode('utf-8'))
+    for pattern in CODE_VERSION_SOURCES:
+        for path in sorted(glob.glob(os.path.join(root, pattern))):
+            digest.update(os.path.relpath(path, root).encode('utf-8'))
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+CODE_VERSION = code_version()
+
+def payload_key(output, value, versions):
+    """
+    Content address of a callback response: its parameters, the code that
+    builds it and the version of the data it reads. A state's bars read
+    only that state.
+    """
+    if output == 'state-graphs.figure':
+        version = versions.get(value, versions['US'])
+    else:
+        version = versions['US']
+    return 'payload:{}:{}:{}:{}'.format(output, value, CODE_VERSION, version)
+
+def payload_labels(output, value):
+    """
+    Metric labels for a callback: the tab it renders and, for the state
+    dropdown, the region.
+    """
+    callback = output.split('.')[0]
+    if output == 'state-graphs.figure':
+        return {'callback': callback, 'tab': 'states', 'region': value}
+    return {'callback': callback, 'tab': value, 'region': ''}
+
+def build_payload(output, value):
+    callback, _ = PAYLOAD_CALLBACKS[output]
+    return make_payload(output.split('.')[-1], callback(value))
+
+def placeholder_payload(output):
+    """
+    Stand-in response sent while neither a snapshot nor a download is
+    available yet. Never cached.
+    """
+    prop = output.split('.')[-1]
+    if prop == 'figure':
+        return make_payload(prop, {
+            'data': [],
+            'layout': {
+                'annotations': [{'text': LOADING_MESSAGE, 'showarrow': False}],
+                'xaxis': {'visible': False},
+                'yaxis': {'visible': False}
+            }
+        })
+    return make_payload(prop, html.P(LOADING_MESSAGE))
+
+def current_payload_keys():
+    """
+    Revalidate the dataset and return when its data was last confirmed
+    current, with {(output, value): key} for the data it now holds.
+    """
+    plotly_figs.dataset.refresh()
+    versions = plotly_figs.versions()
+    return plotly_figs.dataset.current_at, {job: payload_key(*job, versions) for job in PAYLOAD_JOBS}
+
+def build_payloads(jobs):
+    """
+    Build the given (output, value) callback responses from the current
+    dataset. Returns {(output, value): Payload}.
+    """
+    # one at a time: building is pure Python under the GIL, and a thread
+    # pool measured slower than this loop
+    plotly_figs.cube()
+    return {job: build_payload(*job) for job in jobs}
+
+def export_static_payloads(path):
+    """
+    Write every callback response to a new version of the static store at
+    path, unless it already holds the current data. Returns the version.
+    """
+    store = StaticFigureStore(path)
+    plotly_figs.dataset.refresh()
+    data_version = '{}:{}'.format(CODE_VERSION, plotly_figs.versions()['US'])
+    manifest = store.manifest()
+    if manifest is not None and manifest.get('data_version') == data_version:
+        return manifest['version']
+    payloads = {static_name(*job): payload for job, payload in build_payloads(PAYLOAD_JOBS).items()}
+    for region in ['US'] + list(STATE_MAPPING):
+        payloads[static_name('bar-series', region)] = make_json_payload(plotly_figs.bar_series(region))
+    return store.write(payloads, data_version)
+
+refresher = BackgroundRefresher(
+    cache, current_payload_keys, build_payloads, UPSTREAM_POLL_INTERVAL, CACHE_DIR + '.lock',
+    code_version=CODE_VERSION
+)
+
+static_figures = StaticFigureStore(STATIC_DIR)
+
+@server.before_request
+def serve_cached_payload():
+    """
+    Answer cacheable Dash callbacks with pre-serialized, pre-compressed
+    bytes, skipping figure objects and Dash's own serialization.
+    """
+    if request.path != app.config.routes_pathname_prefix + '_dash-update-component':
+        return None
+    body = request.get_json(silent=True) or {}
+    output = body.get('output')
+    inputs = body.get('inputs', [])
+    if output not in PAYLOAD_CALLBACKS or not inputs:
+        return None
+    # the first input selects the cached response; a call triggered by any
+    # other input (a zoom) needs a figure built for it
+    other_inputs = {'{}.{}'.format(item.get('id'), item.get('property')) for item in inputs[1:]}
+    if other_inputs & set(body.get('changedPropIds', [])):
+        return None
+    _, values = PAYLOAD_CALLBACKS[output]
+    value = inputs[0].get('value')
+    if value not in values:
+        return None
+    labels = payload_labels(output, value)
+
+    # exports are only read in master mode, so a store left over from an
+    # earlier deployment cannot hide the figures a worker keeps fresh
+    static = None
+    if FIGURE_BUILDER == 'master':
+        static = static_figures.lookup(static_name(output, value), request.accept_encodings)
+    if static is not None:
+        with CALLBACK_SECONDS.labels(**labels).time():
+            PAYLOAD_LOOKUPS.labels(**labels).inc()
+            path, encoding = static
+            response = send_file(path, mimetype='application/json', conditional=False)
+            if encoding is not None:
+                response.headers['Content-Encoding'] = encoding
+            response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+    def build():
+        PAYLOAD_MISSES.labels(**labels).inc()
+        # a cold worker builds from the local snapshot at most; downloads
+        # only ever happen in the background refresher
+        if not dataset_available():
+            return None, None
+        with PAYLOAD_BUILD_SECONDS.labels(**labels).time():
+            key = payload_key(output, value, plotly_figs.versions())
+            return key, build_payload(output, value)
+
+    with CALLBACK_SECONDS.labels(**labels).time():
+        PAYLOAD_LOOKUPS.labels(**labels).inc()
+        payload = refresher.get((output, value), build)
+        cacheable = payload is not None
+        if not cacheable:
+            payload = placeholder_payload(output)
+        data, encoding = payload.encode(request.accept_encodings)
+        response = server.response_class(data, mimetype='application/json')
+        if not cacheable:
+            response.headers['Cache-Control'] = 'no-store'
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+@server.route('/figures/<version>/<path:filename>')
+def serve_static_figure(version, filename):
+    """
+    Exported responses by version; the files never change once written.
+    """
+    if not static_figures.has_version(version):
+        abort(404)
+    # joined under STATIC_DIR so safe_join checks the whole path
+    return send_from_directory(STATIC_DIR, '/'.join([version, filename]), cache_timeout=TIMEOUT * 24 * 365)
+
+@server.route('/metrics')
+def metrics():
+    data, content_type = metrics_response()
+    return server.response_class(data, content_type=content_type)
+
+def start_refresher():
+    """
+    Keep this process's figures fresh in the background, unless the
+    exporter's figures answer every cacheable callback instead. Called from
+    gunicorn's post_worker_init hook, so exports never start it.
+    """
+    if FIGURE_BUILDER == 'master':
+        return None
+    return refresher.start()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='COVID-19 Tracker Dash')
+    parser.add_argument('--export', metavar='DIR', nargs='?', const=STATIC_DIR,
+        help='build every figure into a versioned static store and exit')
+    parser.add_argument('--interval', metavar='SECONDS', type=int,
+        help='with --export, keep running and export again every SECONDS')
+    args = parser.parse_args(argv)
+    if args.export and args.interval:
+        # one long-lived process keeps the dataset and growth offsets
+        # between exports, so each one only adds the new days
+        while True:
+            try:
+                print(export_static_payloads(args.export), flush=True)
+            except Exception:
+                traceback.print_exc()
+            time.sleep(args.interval)
+    if args.export:
+        print(export_static_payloads(args.export))
+        return 0
+    start_refresher()
     app.run_server(debug=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,15 @@
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    axes: {
+        /*
+         * Return a copy of the figure with its y axis switched between
+         * linear and log, leaving the traces untouched.
+         */
+        set_yaxis_type: function(value, figure) {
+            var layout = Object.assign({}, figure.layout);
+            layout.yaxis = Object.assign({}, layout.yaxis, {
+                type: value === 'Linear' ? 'linear' : 'log'
+            });
+            return Object.assign({}, figure, {layout: layout});
+        }
+    }
+});
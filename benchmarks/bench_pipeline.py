@@ -0,0 +1,319 @@
+"""
+Offline benchmarks for the figure pipeline.
+
+Recorded API fixtures are served from a local stand-in server and every
+stage (fetch, parse, aggregate, geometry, figure build, serialize, Dash
+callback) is timed by its median over --repeat runs and measured for peak
+memory separately. The baseline takes the middle of three such
+measurements, and --check times a stage that looks slower once more
+before reporting it, so one burst of load elsewhere is not a regression.
+A small synthetic fixture and its baseline are
+committed; a longer history can be recorded or generated before saving a
+new baseline:
+
+    python -m benchmarks.bench_pipeline --record        # record fixtures
+    python -m benchmarks.bench_pipeline --synthetic 300 # or generate them
+    python -m benchmarks.bench_pipeline --save-baseline
+    python -m benchmarks.bench_pipeline --check         # compare to baseline
+"""
+import argparse
+import datetime
+import functools
+import gc
+import http.server
+import json
+import os
+import math
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import requests
+
+from metadata.states import STATE_MAPPING, STATE_POP
+from plots.cube import MetricCube
+from plots.geometry import DEFAULT_GEOMETRY_LEVEL, GEOMETRY_LEVELS, GEOMETRY_SOURCE_URL, simplify_geojson
+from plots.payloads import make_payload
+from plots.plotly_figs import BASE_API_URL, PlotlyFigs
+from plots.rolling import RollingAnalytics
+from plots.streaming import STREAM_CHUNK_SIZE
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(BENCHMARK_DIR, 'fixtures')
+BASELINE_PATH = os.path.join(BENCHMARK_DIR, 'baseline.json')
+
+FIXTURE_ENDPOINTS = [
+    'states/daily.json',
+    'states/current.json'
+]
+GEOJSON_FIXTURE = 'geo/gz_2010_us_040_00_500k.json'
+
+# a stage regresses when its median is this much slower, or its peak this
+# much larger, than the baseline's and also worse by more than the floor.
+# Medians still drift 10-20% between runs on a shared machine, and
+# millisecond stages are timer noise below the floor; peak memory is close
+# to deterministic.
+REGRESSION_WALL_RATIO = 1.25
+REGRESSION_FLOOR_MS = 5
+REGRESSION_PEAK_RATIO = 1.10
+REGRESSION_FLOOR_KIB = 256
+BASELINE_RUNS = 3
+
+# points per synthetic state outline
+SYNTHETIC_OUTLINE_POINTS = 200
+
+def _write_fixture(path, content):
+    path = os.path.join(FIXTURE_DIR, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+def record_fixtures():
+    """
+    Download the live API responses and census outlines into FIXTURE_DIR.
+    """
+    for endpoint in FIXTURE_ENDPOINTS:
+        _write_fixture(endpoint, requests.get('/'.join([BASE_API_URL.rstrip('/'), endpoint])).content)
+    _write_fixture(GEOJSON_FIXTURE, requests.get(GEOMETRY_SOURCE_URL).content)
+
+def synthesize_fixtures(days):
+    """
+    Generate API-shaped fixtures covering every state with a population
+    for the given number of days, for running without recorded data.
+    """
+    names = {name: code for code, name in STATE_MAPPING.items()}
+    codes = [names[row['State']] for row in STATE_POP['data'] if row['State'] in names]
+    start = datetime.date(2020, 3, 1)
+    rng = random.Random(0)
+    rows = []
+    totals = {code: [0, 0] for code in codes}
+    for day in range(days):
+        date = int((start + datetime.timedelta(days=day)).strftime('%Y%m%d'))
+        for code in codes:
+            positive_increase = rng.randint(0, 2000)
+            test_increase = positive_increase + rng.randint(0, 20000)
+            totals[code][0] += positive_increase
+            totals[code][1] += test_increase
+            rows.append({
+                'date': date,
+                'state': code,
+                'positive': totals[code][0],
+                'positiveIncrease': positive_increase,
+                'totalTestResults': totals[code][1],
+                'totalTestResultsIncrease': test_increase,
+                'hospitalizedIncrease': rng.randint(0, 200),
+                'deathIncrease': rng.randint(0, 50),
+                'dataQualityGrade': rng.choice(['A+', 'A', 'B', 'C'])
+            })
+    rows.reverse()
+    _write_fixture('states/daily.json', json.dumps(rows).encode('utf-8'))
+    _write_fixture('states/current.json', json.dumps(rows[:len(codes)]).encode('utf-8'))
+
+    # a noisy circle per state stands in for the census outlines
+    features = []
+    for i, code in enumerate(codes):
+        center = (-120 + 5 * (i % 10), 30 + 4 * (i // 10))
+        ring = []
+        for point in range(SYNTHETIC_OUTLINE_POINTS):
+            angle = 2 * math.pi * point / SYNTHETIC_OUTLINE_POINTS
+            radius = 1.5 + 0.1 * rng.random()
+            ring.append([round(center[0] + radius * math.cos(angle), 5), round(center[1] + radius * math.sin(angle), 5)])
+        ring.append(ring[0])
+        features.append({
+            'type': 'Feature',
+            'properties': {'NAME': STATE_MAPPING[code]},
+            'geometry': {'type': 'Polygon', 'coordinates': [ring]}
+        })
+    _write_fixture(GEOJSON_FIXTURE, json.dumps({'type': 'FeatureCollection', 'features': features}).encode('utf-8'))
+
+def serve_fixtures():
+    """
+    Serve FIXTURE_DIR over HTTP on a free local port from a daemon thread.
+    Returns the server and its base URL.
+    """
+    handler = functools.partial(QuietHandler, directory=FIXTURE_DIR)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+def measure(fn, repeat):
+    """
+    Median wall time over repeat runs, then peak traced memory of one more
+    run.
+    """
+    wall = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        wall.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'wall_ms': statistics.median(wall) * 1000, 'peak_kib': peak / 1024}
+
+def run_stages(base_url):
+    """
+    {stage name: function} for every stage, in order.
+    """
+    figs = PlotlyFigs(STATE_MAPPING, STATE_POP, base_url=base_url)
+    session = requests.Session()
+    raw = session.get(base_url + '/states/daily.json').content
+    data = json.loads(raw)
+    df = figs.dataset.parse(data)
+    figs.dataset.refresh()
+
+    figures = {
+        'bar-US': lambda: figs.make_bar_figures('US'),
+        'bar-NY': lambda: figs.make_bar_figures('NY'),
+        'maps': figs.make_map_figures,
+        'growth': figs.make_state_growth_plots,
+        'trends': figs.make_trend_comparison
+    }
+    built = {name: build() for name, build in figures.items()}
+
+    stages = [
+        ('fetch:daily', lambda: session.get(base_url + '/states/daily.json').content),
+        ('parse:json', lambda: json.loads(raw)),
+        ('parse:dataframe', lambda: figs.dataset.parse(data)),
+        ('parse:stream', lambda: figs.dataset.parse_stream(
+            raw[i:i + STREAM_CHUNK_SIZE] for i in range(0, len(raw), STREAM_CHUNK_SIZE))),
+        ('aggregate:cube', lambda: MetricCube(df, STATE_MAPPING, STATE_POP)),
+        ('aggregate:rolling', lambda: RollingAnalytics(figs.cube()))
+    ]
+    geojson = json.loads(session.get(base_url + '/' + GEOJSON_FIXTURE).content)
+    tolerance, precision = GEOMETRY_LEVELS[DEFAULT_GEOMETRY_LEVEL]
+    stages += [
+        ('fetch:geojson', lambda: session.get(base_url + '/' + GEOJSON_FIXTURE).content),
+        ('geometry:simplify', lambda: simplify_geojson(geojson, tolerance, precision))
+    ]
+    stages += [('figure:' + name, build) for name, build in figures.items()]
+    stages += [
+        ('serialize:' + name, functools.partial(make_payload, 'figure', fig))
+        for name, fig in built.items()
+    ]
+
+    # the callbacks as the app runs them, reading the same dataset; the app
+    # is imported with a cache of its own so nothing is read from or left
+    # in the live one
+    os.environ['CACHE_DIR'] = os.path.join(tempfile.mkdtemp(prefix='bench-'), 'cache')
+    import app
+    app.plotly_figs = figs
+    client = app.server.test_client()
+    body = {
+        'output': 'tabs-content.children',
+        'inputs': [{'id': 'tabs', 'property': 'value', 'value': 'us'}],
+        'changedPropIds': ['tabs.value']
+    }
+    update_path = app.app.config.routes_pathname_prefix + '_dash-update-component'
+    # the first call builds the cached payload that the timed calls serve
+    client.post(update_path, json=body)
+    stages += [
+        ('callback:render-us', lambda: app.render_content.__wrapped__('us')),
+        ('callback:cached-us', lambda: client.post(update_path, json=body).data)
+    ]
+    return dict(stages)
+
+def compare(results, baseline):
+    """
+    Print each stage against the baseline. Returns the regressed stages and
+    the baseline stages that were not run, e.g. after a rename.
+    """
+    regressions = []
+    print('{:<22}{:>12}{:>12}{:>10}{:>12}{:>10}'.format('stage', 'wall ms', 'peak KiB', 'x wall', 'base ms', 'x peak'))
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print('{:<22}{:>12.2f}{:>12.0f}'.format(name, result['wall_ms'], result['peak_kib']))
+            continue
+        wall_ratio = result['wall_ms'] / base['wall_ms'] if base['wall_ms'] else float('inf')
+        peak_ratio = result['peak_kib'] / base['peak_kib'] if base['peak_kib'] else float('inf')
+        print('{:<22}{:>12.2f}{:>12.0f}{:>10.2f}{:>12.2f}{:>10.2f}'.format(
+            name, result['wall_ms'], result['peak_kib'], wall_ratio, base['wall_ms'], peak_ratio))
+        if _stage_regressed(result, base):
+            regressions.append(name)
+    missing = [name for name in baseline if name not in results]
+    new = [name for name in results if name not in baseline]
+    if missing:
+        print('missing from this run: ' + ', '.join(missing))
+    if new:
+        print('not in the baseline: ' + ', '.join(new))
+    return regressions, missing
+
+def _stage_regressed(result, base):
+    return base is not None and (
+        _regressed(result['wall_ms'], base['wall_ms'], REGRESSION_WALL_RATIO, REGRESSION_FLOOR_MS)
+        or _regressed(result['peak_kib'], base['peak_kib'], REGRESSION_PEAK_RATIO, REGRESSION_FLOOR_KIB)
+    )
+
+def _regressed(value, base, ratio, floor):
+    return value > base * ratio and value - base > floor
+
+def _fastest(first, second):
+    return {key: min(first[key], second[key]) for key in first}
+
+def _middle(results):
+    return {key: statistics.median(result[key] for result in results) for key in results[0]}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--record', action='store_true', help='record fixtures from the live API first')
+    parser.add_argument('--synthetic', type=int, metavar='DAYS', help='generate synthetic fixtures first')
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--check', action='store_true', help='exit non-zero on a regression')
+    args = parser.parse_args(argv)
+
+    if args.record:
+        record_fixtures()
+    elif args.synthetic:
+        synthesize_fixtures(args.synthetic)
+    if not os.path.exists(os.path.join(FIXTURE_DIR, 'states', 'daily.json')):
+        parser.error('no fixtures in {}, run with --record or --synthetic'.format(FIXTURE_DIR))
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+
+    server, base_url = serve_fixtures()
+    try:
+        stages = run_stages(base_url)
+        if args.save_baseline:
+            results = {
+                name: _middle([measure(fn, args.repeat) for _ in range(BASELINE_RUNS)])
+                for name, fn in stages.items()
+            }
+        else:
+            results = {name: measure(fn, args.repeat) for name, fn in stages.items()}
+        for name, result in results.items():
+            if not args.save_baseline and _stage_regressed(result, baseline.get(name)):
+                # a burst of load elsewhere rarely hits the same stage twice
+                results[name] = _fastest(result, measure(stages[name], args.repeat))
+    finally:
+        server.shutdown()
+
+    regressions, missing = compare(results, baseline)
+
+    if args.save_baseline:
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    elif args.check and (regressions or missing):
+        if regressions:
+            print('regressed: ' + ', '.join(regressions))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
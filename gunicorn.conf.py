@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# imported once in the master so every forked worker shares the loaded
+# modules instead of importing them again at boot
+import pandas
+import plotly.express
+import plotly.subplots
+
+# seconds between figure exports; an export of unchanged upstream data
+# stops after revalidating it, so this can be short
+EXPORT_INTERVAL = int(os.environ.get('EXPORT_INTERVAL', 300))
+
+# share metrics between workers so /metrics reports the whole server,
+# whichever worker answers the scrape
+os.environ.setdefault('prometheus_multiproc_dir', tempfile.mkdtemp(prefix='prometheus-'))
+
+# an exporter process started by the master builds every figure into one
+# static store that all workers serve read-only through the page cache, so
+# no worker holds its own dataset, figures or payload copies; set
+# FIGURE_BUILDER=worker to have each worker refresh its own instead
+os.environ.setdefault('FIGURE_BUILDER', 'master')
+os.environ.setdefault('STATIC_FIGURE_DIR', 'static-figure-directory')
+
+_exporter = None
+
+def when_ready(server):
+    """
+    Start the figure exporter as its own long-running process rather than
+    a thread of the master, so nothing but gunicorn runs in the process
+    workers are forked from. It does not write prometheus metrics files,
+    which would be left behind in the shared directory.
+    """
+    global _exporter
+    if os.environ['FIGURE_BUILDER'] == 'master':
+        env = {name: value for name, value in os.environ.items() if name != 'prometheus_multiproc_dir'}
+        _exporter = subprocess.Popen(
+            [sys.executable, 'app.py', '--export', os.environ['STATIC_FIGURE_DIR'], '--interval', str(EXPORT_INTERVAL)],
+            env=env,
+            stdout=subprocess.DEVNULL
+        )
+
+def on_exit(server):
+    if _exporter is not None:
+        _exporter.terminate()
+        _exporter.wait()
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+def post_fork(server, worker):
+    os.environ['WORKER_STARTED_AT'] = str(time.time())
+
+def post_worker_init(worker):
+    import app
+    app.start_refresher()
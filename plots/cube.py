@@ -0,0 +1,183 @@
+import copy
+import weakref
+
+import numpy as np
+
+BASE_METRICS = [
+    'positive',
+    'positiveIncrease',
+    'totalTestResults',
+    'totalTestResultsIncrease',
+    'hospitalizedIncrease',
+    'deathIncrease'
+]
+
+DERIVED_METRICS = [
+    'positives_per_capita',
+    'positives_per_million',
+    'tests_per_capita',
+    'tests_per_million',
+    'positive_rate'
+]
+
+METRICS = BASE_METRICS + DERIVED_METRICS
+
+GRADES = ['A', 'A+']
+
+class MetricCube:
+    """
+    Dense date x state x metric array built once per dataset version.
+
+    Missing (date, state) cells are NaN. Per-capita metrics and the
+    positive rate (only for days with an 'A' data quality grade) are
+    computed up front for every state, and national totals are a single
+    reduction over the state axis.
+
+    extend() builds the cube of a dataset that only appends later dates
+    from just the new rows. The arrays are views of growable buffers shared
+    with the previous cube, which never sees the rows added after it, and
+    base names that previous cube while it is still in use.
+    """
+
+    def __init__(self, df, state_mapping, state_pop):
+        self.states = list(df['state'].cat.categories)
+        self.state_names = np.array([state_mapping.get(state) for state in self.states], dtype=object)
+        self.state_index = {state: i for i, state in enumerate(self.states)}
+        self.metric_index = {metric: i for i, metric in enumerate(METRICS)}
+
+        populations = {row['State']: row['Population'] for row in state_pop['data']}
+        self.population = np.array([populations.get(name, np.nan) for name in self.state_names], dtype='float64')
+
+        self.dates = np.empty(0, dtype='datetime64[ns]')
+        self._base = None
+        self._buffers = _CubeBuffers(len(self.states))
+        self._append(df)
+
+    @property
+    def base(self):
+        """
+        The cube this one was extended from, or None for a cube built from
+        a whole dataset. Held weakly, so a chain of extended cubes does not
+        keep every earlier one alive.
+        """
+        return self._base() if self._base is not None else None
+
+    def extend(self, df):
+        """
+        The cube of this cube's dataset plus the rows of df, which must all
+        be dated after this cube's last date and use the same states.
+        """
+        cube = copy.copy(self)
+        cube._base = weakref.ref(self)
+        if self._buffers.rows != len(self.dates):
+            # another cube was already extended from this one
+            cube._buffers = self._buffers.copy(len(self.dates))
+        cube._append(df)
+        return cube
+
+    def _append(self, df):
+        new_dates = np.unique(df['date'].to_numpy())
+        start = len(self.dates)
+        end = start + len(new_dates)
+        buffers = self._buffers
+        buffers.reserve(end)
+
+        state_codes = df['state'].cat.codes.to_numpy()
+        rows = state_codes >= 0
+        date_codes = np.searchsorted(new_dates, df['date'].to_numpy()[rows])
+        state_codes = state_codes[rows]
+
+        values = buffers.values[start:end]
+        values[:] = np.nan
+        values[date_codes, state_codes, :len(BASE_METRICS)] = df[BASE_METRICS].to_numpy('float64')[rows]
+        graded = buffers.graded[start:end]
+        graded[:] = False
+        graded[date_codes, state_codes] = df['dataQualityGrade'].isin(GRADES).to_numpy()[rows]
+
+        def metric(name):
+            return values[:, :, self.metric_index[name]]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            metric('positives_per_capita')[:] = metric('positive') / self.population
+            metric('positives_per_million')[:] = metric('positives_per_capita') * 1000000
+            metric('tests_per_capita')[:] = metric('totalTestResults') / self.population
+            metric('tests_per_million')[:] = metric('tests_per_capita') * 1000000
+            metric('positive_rate')[:] = np.where(
+                graded,
+                metric('positiveIncrease') / metric('totalTestResultsIncrease'),
+                np.nan
+            )
+
+        buffers.national[start:end] = np.nansum(values[:, :, :len(BASE_METRICS)], axis=1)
+        graded_increases = _graded_sum(values, graded, [
+            self.metric_index['positiveIncrease'],
+            self.metric_index['totalTestResultsIncrease']
+        ], axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            buffers.national_positive_rate[start:end] = graded_increases[:, 0] / graded_increases[:, 1]
+
+        buffers.rows = end
+        self.dates = np.concatenate([self.dates, new_dates])
+        self.values = buffers.values[:end]
+        self.graded = buffers.graded[:end]
+        self.national = buffers.national[:end]
+        self.national_positive_rate = buffers.national_positive_rate[:end]
+
+    def __getitem__(self, metric):
+        return self.values[:, :, self.metric_index[metric]]
+
+    def graded_sum(self, metrics, axis):
+        """
+        Sum metrics over an axis counting only 'A' graded cells. Returns
+        NaN where no cell was graded.
+        """
+        return _graded_sum(self.values, self.graded, [self.metric_index[metric] for metric in metrics], axis)
+
+    def series(self, metric, state):
+        """
+        Daily values of one metric for a state code, or for the national
+        total when state is 'US'.
+        """
+        if state == 'US':
+            if metric == 'positive_rate':
+                return self.national_positive_rate
+            return self.national[:, self.metric_index[metric]]
+        if state not in self.state_index:
+            return np.full(len(self.dates), np.nan)
+        return self[metric][:, self.state_index[state]]
+
+class _CubeBuffers:
+    """
+    Cube arrays with room for more dates. Rows below rows are filled and
+    never written again.
+    """
+
+    def __init__(self, n_states, capacity=0):
+        self.rows = 0
+        self.values = np.empty((capacity, n_states, len(METRICS)))
+        self.graded = np.empty((capacity, n_states), dtype=bool)
+        self.national = np.empty((capacity, len(BASE_METRICS)))
+        self.national_positive_rate = np.empty(capacity)
+
+    def copy(self, rows):
+        buffers = _CubeBuffers(self.values.shape[1], rows)
+        buffers.rows = rows
+        for name in ('values', 'graded', 'national', 'national_positive_rate'):
+            getattr(buffers, name)[:] = getattr(self, name)[:rows]
+        return buffers
+
+    def reserve(self, rows):
+        if rows <= len(self.values):
+            return
+        capacity = max(rows, 2 * len(self.values))
+        for name in ('values', 'graded', 'national', 'national_positive_rate'):
+            filled = getattr(self, name)[:self.rows]
+            array = np.empty((capacity,) + filled.shape[1:], dtype=filled.dtype)
+            array[:self.rows] = filled
+            setattr(self, name, array)
+
+def _graded_sum(values, graded, metric_indices, axis):
+    values = np.where(graded[:, :, None], values[:, :, metric_indices], np.nan)
+    sums = np.nansum(values, axis=axis)
+    any_graded = graded.any(axis=axis)
+    return np.where(any_graded[:, None], sums, np.nan)
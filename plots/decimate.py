@@ -0,0 +1,77 @@
+import numpy as np
+
+# traces with more points than this are decimated before they are sent
+DECIMATE_POINTS = 1000
+
+def lttb_indices(y, n_out):
+    """
+    Largest-Triangle-Three-Buckets over equally spaced points: indices of
+    n_out points that keep the visual shape of the line through y.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    # NaN gaps are only left out of the geometry, not the selected values
+    y = np.nan_to_num(y)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    indices = np.empty(n_out, dtype=int)
+    indices[0] = 0
+    indices[-1] = n - 1
+    selected = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_start, next_end = end, edges[bucket + 2]
+        else:
+            next_start, next_end = n - 1, n
+        next_x = (next_start + next_end - 1) / 2
+        next_y = y[next_start:next_end].mean()
+        x = np.arange(start, end)
+        areas = np.abs(
+            (selected - next_x) * (y[start:end] - y[selected])
+            - (selected - x) * (next_y - y[selected])
+        )
+        selected = start + int(areas.argmax())
+        indices[bucket + 1] = selected
+    return indices
+
+def minmax_indices(y, n_out):
+    """
+    Indices of the smallest and largest value in each of n_out // 2 equal
+    buckets, in order, so spikes survive decimation. Suited to bars.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 2:
+        return np.arange(n)
+    y = np.nan_to_num(y)
+    edges = np.linspace(0, n, n_out // 2 + 1).astype(int)
+    indices = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        if end > start:
+            bucket = y[start:end]
+            indices.extend(sorted({start + int(bucket.argmin()), start + int(bucket.argmax())}))
+    return np.array(indices, dtype=int)
+
+DECIMATORS = {
+    'lttb': lttb_indices,
+    'minmax': minmax_indices
+}
+
+def decimate(x, y, method, n_out=DECIMATE_POINTS):
+    """
+    (x, y) reduced to about n_out points with the named method, or as
+    they are when already short enough.
+    """
+    if len(y) <= n_out:
+        return x, y
+    indices = DECIMATORS[method](y, n_out)
+    return x[indices], y[indices]
+
+def window(x, y, start, end):
+    """
+    The points of (x, y) with start <= x <= end, plus one neighbour on each
+    side so lines run to the edges of the view. x must be sorted.
+    """
+    lo = max(np.searchsorted(x, start, side='left') - 1, 0)
+    hi = min(np.searchsorted(x, end, side='right') + 1, len(x))
+    return x[lo:hi], y[lo:hi]
@@ -0,0 +1,121 @@
+import json
+import os
+import tempfile
+
+import requests
+
+GEOMETRY_SOURCE_URL = 'https://eric.clst.org/assets/wiki/uploads/Stuff/gz_2010_us_040_00_500k.json'
+
+GEOMETRY_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'metadata', 'geo')
+
+# level of detail -> (Douglas-Peucker tolerance in degrees, decimal places kept)
+GEOMETRY_LEVELS = {
+    'low': (0.05, 2),
+    'medium': (0.01, 3),
+    'high': (0.002, 4)
+}
+
+DEFAULT_GEOMETRY_LEVEL = 'medium'
+
+GEOMETRY_URL = '/geo/us-states-{}.json'
+
+def geometry_path(level):
+    return os.path.join(GEOMETRY_DIR, 'us-states-{}.json'.format(level))
+
+def missing_geometry_levels():
+    """
+    Levels of detail whose file has not been generated yet.
+    """
+    return [level for level in GEOMETRY_LEVELS if not os.path.exists(geometry_path(level))]
+
+def geometry_url(level=DEFAULT_GEOMETRY_LEVEL):
+    """
+    URL the app serves a level of detail from. Figures reference it instead
+    of embedding the outlines, so the browser downloads them once.
+    """
+    return GEOMETRY_URL.format(level)
+
+def _perpendicular_distance(point, start, end):
+    dx = end[0] - start[0]
+    dy = end[1] - start[1]
+    if dx == 0 and dy == 0:
+        return ((point[0] - start[0]) ** 2 + (point[1] - start[1]) ** 2) ** 0.5
+    return abs(dy * point[0] - dx * point[1] + end[0] * start[1] - end[1] * start[0]) / (dx * dx + dy * dy) ** 0.5
+
+def simplify_line(points, tolerance):
+    """
+    Douglas-Peucker simplification of a list of [lon, lat] points.
+    """
+    if len(points) < 3:
+        return points
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        max_distance = 0
+        index = None
+        for i in range(first + 1, last):
+            distance = _perpendicular_distance(points[i], points[first], points[last])
+            if distance > max_distance:
+                max_distance = distance
+                index = i
+        if index is not None and max_distance > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+def _simplify_polygon(rings, tolerance, precision):
+    simplified = []
+    for ring in rings:
+        ring = [[round(lon, precision), round(lat, precision)] for lon, lat in simplify_line(ring, tolerance)]
+        # a closed ring needs at least four points, small islands are dropped
+        if len(ring) >= 4:
+            simplified.append(ring)
+    return simplified
+
+def simplify_geojson(geojson, tolerance, precision):
+    """
+    Simplify every state outline and keep only the NAME property that the
+    choropleth featureidkey matches on.
+    """
+    features = []
+    for feature in geojson['features']:
+        geometry = feature['geometry']
+        if geometry['type'] == 'Polygon':
+            polygons = [geometry['coordinates']]
+        else:
+            polygons = geometry['coordinates']
+        polygons = [_simplify_polygon(polygon, tolerance, precision) for polygon in polygons]
+        polygons = [polygon for polygon in polygons if polygon]
+        if not polygons:
+            continue
+        features.append({
+            'type': 'Feature',
+            'properties': {'NAME': feature['properties']['NAME']},
+            'geometry': {'type': 'MultiPolygon', 'coordinates': polygons}
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+def build_geometry_store(source_url=GEOMETRY_SOURCE_URL):
+    """
+    Download the census state outlines once and write every level of detail
+    to the bundled geometry directory. Run at build time, see
+    bin/post_compile; each file is replaced atomically.
+    """
+    response = requests.get(source_url)
+    # fail the build on an error page rather than ship without outlines
+    response.raise_for_status()
+    source = response.json()
+    os.makedirs(GEOMETRY_DIR, exist_ok=True)
+    for level, (tolerance, precision) in GEOMETRY_LEVELS.items():
+        simplified = simplify_geojson(source, tolerance, precision)
+        fd, tmp_path = tempfile.mkstemp(dir=GEOMETRY_DIR, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(simplified, f, separators=(',', ':'))
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, geometry_path(level))
+
+if __name__ == '__main__':
+    build_geometry_store()
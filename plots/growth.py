@@ -0,0 +1,58 @@
+import numpy as np
+
+class ThresholdOffsets:
+    """
+    Days since each state's metric first reached a threshold, counted like
+    groupby('state').cumcount() over the qualifying rows.
+
+    Running per-state counts are kept between updates, so when a new cube
+    only appends dates to the previous one just the new rows are examined.
+    """
+
+    def __init__(self, metric, threshold):
+        self.metric = metric
+        self.threshold = threshold
+        self.states = None
+        self.n_dates = 0
+        self.counts = None
+        self._days = None
+
+    @property
+    def days(self):
+        """
+        date x state offsets, -1 where the state is below the threshold.
+        """
+        return self._days[:self.n_dates]
+
+    def _reset(self, cube):
+        n_states = len(cube.states)
+        self.states = list(cube.states)
+        self.n_dates = 0
+        self.counts = np.zeros(n_states, dtype='int32')
+        self._days = np.empty((0, n_states), dtype='int32')
+
+    def _reserve(self, n_dates):
+        if n_dates > len(self._days):
+            capacity = max(n_dates, 2 * len(self._days))
+            days = np.empty((capacity, len(self.states)), dtype='int32')
+            days[:self.n_dates] = self.days
+            self._days = days
+
+    def update(self, cube, include, appended):
+        """
+        Bring the offsets up to date with cube. include masks the states
+        that may qualify; appended says cube only adds dates to the cube
+        of the previous update.
+        """
+        if not appended or self.states != cube.states or len(cube.dates) < self.n_dates:
+            self._reset(cube)
+        start = self.n_dates
+        with np.errstate(invalid='ignore'):
+            mask = (cube[self.metric][start:] >= self.threshold) & include
+        days = np.where(mask, self.counts + np.cumsum(mask, axis=0) - 1, -1)
+
+        self._reserve(len(cube.dates))
+        self._days[start:len(cube.dates)] = days
+        self.n_dates = len(cube.dates)
+        self.counts = self.counts + mask.sum(axis=0, dtype='int32')
+        return self.days
@@ -0,0 +1,110 @@
+import hashlib
+import threading
+import time
+from collections import namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from plots.metrics import FETCH_SECONDS
+from plots.streaming import STREAM_CHUNK_SIZE
+from plots.tracing import span
+
+# (connect, read) seconds
+DEFAULT_TIMEOUT = (3.05, 30)
+
+DataResponse = namedtuple('DataResponse', ['data', 'version', 'not_modified'])
+
+class DataClient:
+    """
+    Pooled HTTP client for the covidtracking.com API.
+
+    Connections are reused through one session, failed requests are retried
+    with exponential backoff, and every response is revalidated with
+    ETag/If-Modified-Since so an unchanged endpoint is answered from the
+    parsed copy kept from the last download.
+    """
+
+    def __init__(self, base_url, timeout=DEFAULT_TIMEOUT, retries=3, backoff_factor=0.5, pool_size=10):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504)
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def url(self, endpoint):
+        return '/'.join([self.base_url, endpoint])
+
+    def get(self, endpoint, parser=None):
+        """
+        Fetch and parse an endpoint. Returns a DataResponse whose
+        not_modified flag is set when the local copy was still current.
+
+        With a parser the body is streamed: parser receives an iterator of
+        byte chunks and its result becomes the response data.
+        """
+        url = self.url(endpoint)
+        with self._lock:
+            entry = self._entries.get(url)
+
+        headers = {}
+        if entry is not None:
+            etag, last_modified, cached = entry
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        start = time.perf_counter()
+        try:
+            with span('fetch.download'):
+                r = self.session.get(url, headers=headers, timeout=self.timeout, stream=parser is not None)
+        except requests.RequestException:
+            FETCH_SECONDS.labels(endpoint, 'error').observe(time.perf_counter() - start)
+            raise
+        FETCH_SECONDS.labels(endpoint, str(r.status_code)).observe(time.perf_counter() - start)
+        # a streamed response holds its pooled connection until closed
+        with r:
+            if r.status_code == 304 and entry is not None:
+                # reading the empty body returns the connection to the pool
+                # instead of closing it
+                r.content
+                return cached._replace(not_modified=True)
+            r.raise_for_status()
+
+            etag = r.headers.get('ETag')
+            last_modified = r.headers.get('Last-Modified')
+            if parser is None:
+                version = etag or hashlib.sha1(r.content).hexdigest()
+            else:
+                version = etag
+            if version is not None and entry is not None and entry[2].version == version:
+                return entry[2]._replace(not_modified=True)
+
+            with span('fetch.decode'):
+                if parser is None:
+                    data = r.json()
+                else:
+                    digest = hashlib.sha1()
+                    data = parser(_hashed(r.iter_content(STREAM_CHUNK_SIZE), digest))
+                    version = etag or digest.hexdigest()
+                    if entry is not None and entry[2].version == version:
+                        return entry[2]._replace(not_modified=True)
+        response = DataResponse(data, version, False)
+        with self._lock:
+            self._entries[url] = (etag, last_modified, response)
+        return response
+
+def _hashed(chunks, digest):
+    for chunk in chunks:
+        digest.update(chunk)
+        yield chunk
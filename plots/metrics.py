@@ -0,0 +1,61 @@
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess
+)
+
+PAYLOAD_LOOKUPS = Counter(
+    'covid_payload_cache_lookups_total',
+    'Callback payload cache lookups.',
+    ['callback', 'tab', 'region']
+)
+PAYLOAD_MISSES = Counter(
+    'covid_payload_cache_misses_total',
+    'Callback payload cache lookups that had to build the payload inline.',
+    ['callback', 'tab', 'region']
+)
+PAYLOAD_BUILD_SECONDS = Histogram(
+    'covid_payload_build_seconds',
+    'Time to build and serialize a callback payload on a cache miss.',
+    ['callback', 'tab', 'region']
+)
+CALLBACK_SECONDS = Histogram(
+    'covid_callback_seconds',
+    'Time to answer a Dash callback request.',
+    ['callback', 'tab', 'region']
+)
+FETCH_SECONDS = Histogram(
+    'covid_upstream_fetch_seconds',
+    'Upstream API request latency.',
+    ['endpoint', 'status'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+
+STAGE_SECONDS = Histogram(
+    'covid_stage_seconds',
+    'Time spent in each figure pipeline stage.',
+    ['stage']
+)
+WORKER_STARTUP_SECONDS = Histogram(
+    'covid_worker_startup_seconds',
+    'Time from a worker process starting to it answering its first request.',
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+
+def metrics_response():
+    """
+    Render every metric in the Prometheus text format. Under gunicorn the
+    per-worker values are merged when prometheus_multiproc_dir is set.
+    """
+    if 'prometheus_multiproc_dir' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,53 @@
+import gzip
+import json
+
+import plotly
+
+from plots.tracing import traced
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = 6
+
+class Payload:
+    """
+    Final JSON bytes of a Dash callback response, kept raw and
+    pre-compressed so cache hits never touch figure objects.
+    """
+
+    @traced('payload.compress')
+    def __init__(self, raw):
+        self.raw = raw
+        self.gzip = gzip.compress(raw, GZIP_LEVEL)
+        self.br = brotli.compress(raw) if brotli is not None else None
+
+    def encode(self, accept_encodings):
+        """
+        Pick the smallest encoding the client accepts. Returns the body and
+        the Content-Encoding to send with it, or None for the raw bytes.
+        """
+        if self.br is not None and 'br' in accept_encodings:
+            return self.br, 'br'
+        if 'gzip' in accept_encodings:
+            return self.gzip, 'gzip'
+        return self.raw, None
+
+@traced('payload.serialize')
+def serialize_callback_output(prop, value):
+    """
+    Serialize a single-output callback result exactly as Dash would send it.
+    """
+    response = {'response': {'props': {prop: value}}}
+    return json.dumps(response, cls=plotly.utils.PlotlyJSONEncoder).encode('utf-8')
+
+def make_payload(prop, value):
+    return Payload(serialize_callback_output(prop, value))
+
+def make_json_payload(value):
+    """
+    A payload of plain JSON rather than a callback response; NaN becomes null.
+    """
+    return Payload(json.dumps(value, cls=plotly.utils.PlotlyJSONEncoder).encode('utf-8'))
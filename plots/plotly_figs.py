@@ -1,13 +1,26 @@
+import logging
+import threading
+import time
+
+import numpy as np
 import pandas as pd
-import requests
 import plotly.graph_objects as go
-import plotly.express as px
 from plotly.subplots import make_subplots
 
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
 
+from plots.cube import MetricCube
+from plots.decimate import DECIMATE_POINTS, decimate, lttb_indices, window
+from plots.geometry import geometry_url
+from plots.growth import ThresholdOffsets
+from plots.http_client import DataClient
+from plots.rolling import RollingAnalytics
+from plots.snapshot import SnapshotStore, rows_after
+from plots.streaming import ColumnBuilder, iter_json_array
+from plots.tracing import span, traced
+
 FIG_FONT_DICT = {
     'family': "Raleway, monospace",
     'size' : 18,
@@ -16,109 +29,422 @@ FIG_FONT_DICT = {
 
 BASE_API_URL = 'https://covidtracking.com/api/v1/'
 
+DATASET_COLUMNS = [
+    'date',
+    'state',
+    'dataQualityGrade',
+    'positive',
+    'positiveIncrease',
+    'totalTestResults',
+    'totalTestResultsIncrease',
+    'hospitalizedIncrease',
+    'deathIncrease'
+]
+
+# counts stay float32 so missing values remain NaN; daily increases are
+# exact, and cumulative totals above 2**24 only lose units
+DATASET_DTYPES = {
+    'state': 'category',
+    'dataQualityGrade': 'category',
+    'positive': 'float32',
+    'positiveIncrease': 'float32',
+    'totalTestResults': 'float32',
+    'totalTestResultsIncrease': 'float32',
+    'hospitalizedIncrease': 'float32',
+    'deathIncrease': 'float32'
+}
+
+# seconds after which a refresh downloads the whole history again instead
+# of only the latest day, to pick up revisions of earlier days
+FULL_DOWNLOAD_INTERVAL = 24 * 3600
+
+BAR_METRICS = [
+    'positiveIncrease',
+    'totalTestResultsIncrease',
+    'hospitalizedIncrease',
+    'deathIncrease'
+]
+
+# one bar trace per subplot row, top to bottom
+BAR_TRACE_COLUMNS = BAR_METRICS + ['positive_rate']
+
+logger = logging.getLogger(__name__)
+
+def parse_dates(dates):
+    """
+    Convert YYYYMMDD integers to datetimes arithmetically instead of
+    formatting and parsing strings.
+    """
+    months = (dates // 10000 - 1970) * 12 + dates // 100 % 100 - 1
+    days = months.astype('datetime64[M]').astype('datetime64[D]') + (dates % 100 - 1)
+    return days.astype('datetime64[ns]')
+
+def typed(df):
+    """
+    Cast a frame read from the snapshot or concatenated from two parses
+    back to DATASET_DTYPES.
+    """
+    for column, dtype in DATASET_DTYPES.items():
+        if str(df[column].dtype) != dtype:
+            series = df[column]
+            if dtype == 'category':
+                series = series.where(series != '')
+            df[column] = series.astype(dtype)
+    return df
+
+def dataset_hashes(df):
+    """
+    Order independent content hashes of a dataset: the sum of the row
+    hashes of each state, and of every row. Sums of appended rows add on.
+    """
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    codes = df['state'].cat.codes.to_numpy()
+    known = codes >= 0
+    sums = np.zeros(len(df['state'].cat.categories), dtype='uint64')
+    np.add.at(sums, codes[known], row_hashes[known])
+    return sums, row_hashes.sum(dtype='uint64')
+
+def dataset_versions(df, hashes=None):
+    """
+    Content hashes of a dataset: one per state over that state's rows, and
+    'US' over every row. Each also names the latest date, since every
+    figure's date axis spans the whole dataset. hashes are the
+    dataset_hashes() of df when already known.
+    """
+    # row order independent, so appending or re-fetching the same rows
+    # keeps the version
+    sums, total = hashes if hashes is not None else dataset_hashes(df)
+    latest = pd.Timestamp(df['date'].max()).strftime('%Y%m%d') if len(df) else 'empty'
+    versions = {
+        state: '{:016x}-{}'.format(int(state_sum), latest)
+        for state, state_sum in zip(df['state'].cat.categories, sums)
+    }
+    versions['US'] = '{:016x}-{}'.format(int(total), latest)
+    return versions
+
+class StatesDataset:
+    """
+    Holds one parsed copy of states/daily.json that every figure builder
+    reads. Held data is only replaced by an explicit refresh(), so readers
+    never wait on a download once anything is loaded.
+
+    With a snapshot store the history is loaded from disk, only the latest
+    day is fetched on refresh, and the last stored copy is served whenever
+    the API cannot be reached.
+    """
+
+    def __init__(self, client, snapshot=None):
+        self.client = client
+        self.snapshot = snapshot
+        # when the held data was last known to match upstream; a failed
+        # refresh leaves it behind other processes that succeeded
+        self.current_at = None
+        self.parent = None
+        self._df = None
+        self._full_download_at = None
+        self._lock = threading.Lock()
+
+    def is_ready(self):
+        return self._df is not None
+
+    def load_snapshot(self):
+        """
+        Load the stored snapshot without touching the network, if nothing
+        is loaded yet. Returns whether a dataset is now available.
+        """
+        with self._lock:
+            if self._df is None and self.snapshot is not None and self.snapshot.exists():
+                self._df = typed(self.snapshot.load())
+                self.current_at = self.snapshot.updated_at()
+            return self._df is not None
+
+    @traced('dataset.parse')
+    def parse(self, rows):
+        """
+        Build a DataFrame of the columns the figure builders read from API
+        rows, skipping every other field and using compact dtypes.
+        """
+        builder = ColumnBuilder(dict(DATASET_DTYPES, date='int32'))
+        for row in rows:
+            builder.add(row)
+        columns = builder.columns()
+        columns['date'] = parse_dates(columns['date'])
+        return pd.DataFrame(columns, columns=DATASET_COLUMNS)
+
+    def parse_stream(self, chunks):
+        """
+        Parse a streamed JSON array body row by row, so the full list of
+        row dicts never exists in memory.
+        """
+        return self.parse(iter_json_array(chunks))
+
+    def _full_download_due(self):
+        # a revalidated, unchanged download does not rewrite the snapshot
+        downloaded_at = max(self.snapshot.replaced_at() or 0, self._full_download_at or 0)
+        return time.time() - downloaded_at > FULL_DOWNLOAD_INTERVAL
+
+    def _fetch_update(self, df):
+        """
+        Return df extended with any new upstream rows, or df itself when
+        upstream has not changed. Sets parent when the result only appends
+        newer dates to df.
+
+        Each state's latest day is compared with that state's own last held
+        date, so a state reporting late is still appended. The full history
+        is downloaded instead when a state is more than a day behind, is
+        new, or FULL_DOWNLOAD_INTERVAL has passed, which also picks up
+        upstream revisions of earlier days.
+        """
+        if df is not None and self.snapshot is not None and not self._full_download_due():
+            response = self.client.get('states/current.json', parser=self.parse_stream)
+            if response.not_modified:
+                return df
+            last_dates = df.groupby('state', observed=True)['date'].max().to_dict()
+            latest = rows_after(response.data, last_dates)
+            if latest.empty:
+                return df
+            gaps = latest['date'] - pd.to_datetime(latest['state'].astype(object).map(last_dates))
+            if not (gaps.isna() | (gaps > pd.Timedelta(days=1))).any():
+                self.snapshot.append(latest)
+                # a late state adds to dates the held frame already has
+                if latest['date'].min() > df['date'].max():
+                    self.parent = df
+                return typed(pd.concat([df, latest], ignore_index=True))
+        response = self.client.get('states/daily.json', parser=self.parse_stream)
+        self._full_download_at = time.time()
+        if response.not_modified and df is not None:
+            return df
+        df = response.data
+        if self.snapshot is not None:
+            self.snapshot.replace(df)
+        return df
+
+    def refresh(self):
+        """
+        Download and parse the national dataset, replacing the held copy
+        only if upstream has changed.
+        """
+        df = self._df
+        if df is None and self.snapshot is not None and self.snapshot.exists():
+            df = typed(self.snapshot.load())
+            self.current_at = self.snapshot.updated_at()
+        self.parent = None
+        started_at = time.time()
+        try:
+            df = self._fetch_update(df)
+            self.current_at = started_at
+        except Exception:
+            if df is None:
+                raise
+            logger.exception('Dataset refresh failed, serving the stored snapshot')
+        self._df = df
+        return df
+
+    @property
+    def df(self):
+        """
+        The held DataFrame, downloaded first only if nothing is held yet.
+        Builders must treat it as read-only.
+        """
+        with self._lock:
+            if self._df is None:
+                self.refresh()
+            return self._df
+
 class PlotlyFigs:
 
-    def __init__(self, state_mapping, state_pop):
+    def __init__(self, state_mapping, state_pop, snapshot_dir=None, base_url=BASE_API_URL):
         self.state_mapping = state_mapping
         self.state_pop = state_pop
+        self.client = DataClient(base_url)
+        snapshot = SnapshotStore(snapshot_dir) if snapshot_dir else None
+        self.dataset = StatesDataset(self.client, snapshot=snapshot)
+        self._cube = None
+        self._cube_source = None
+        self._cube_lock = threading.Lock()
+        self._growth_offsets = {
+            'days_since_hundredth_case': ThresholdOffsets('positive', 100),
+            'days_since_10_per_million': ThresholdOffsets('positives_per_million', 10)
+        }
+        self._growth_cube = None
+        self._analytics = None
+        self._analytics_cube = None
+        self._versions = None
+        self._versions_source = None
+        self._hashes = None
+        self._bar_templates = {}
+        self._bar_templates_lock = threading.Lock()
+
+    def _appended(self, source):
+        """
+        Whether the current dataset only appends rows to source, with the
+        same states, so results for source can be extended.
+        """
+        df = self.dataset.df
+        return (
+            source is not None
+            and self.dataset.parent is source
+            and list(df['state'].cat.categories) == list(source['state'].cat.categories)
+        )
+
+    def cube(self):
+        """
+        The metric cube for the current dataset, rebuilt only when the
+        dataset has changed and extended with just the new rows when it
+        was appended to.
+        """
+        df = self.dataset.df
+        with self._cube_lock:
+            if self._cube_source is not df:
+                with span('cube.build'):
+                    if self._appended(self._cube_source):
+                        self._cube = self._cube.extend(df.iloc[len(self._cube_source):])
+                    else:
+                        self._cube = MetricCube(df, self.state_mapping, self.state_pop)
+                self._cube_source = df
+            return self._cube
+
+    def versions(self):
+        """
+        dataset_versions() of the current dataset, hashing only the new rows
+        when it was appended to.
+        """
+        df = self.dataset.df
+        with self._cube_lock:
+            if self._versions_source is not df:
+                with span('dataset.version'):
+                    if self._appended(self._versions_source):
+                        sums, total = dataset_hashes(df.iloc[len(self._versions_source):])
+                        # sums wrap around like the full hash does
+                        with np.errstate(over='ignore'):
+                            self._hashes = (self._hashes[0] + sums, self._hashes[1] + total)
+                    else:
+                        self._hashes = dataset_hashes(df)
+                    self._versions = dataset_versions(df, self._hashes)
+                self._versions_source = df
+            return self._versions
+
+    def growth_offsets(self):
+        """
+        Days-since-threshold offsets for the current cube, updated only for
+        the new dates when the cube was extended from the one the offsets
+        were last computed for.
+        """
+        cube = self.cube()
+        with self._cube_lock:
+            if self._growth_cube is not cube:
+                include = ~np.isnan(cube.population)
+                appended = self._growth_cube is not None and cube.base is self._growth_cube
+                for offsets in self._growth_offsets.values():
+                    offsets.update(cube, include, appended)
+                self._growth_cube = cube
+            return {column: offsets.days for column, offsets in self._growth_offsets.items()}
 
-    def get_data(self, endpoint):
+    def analytics(self):
         """
-        Retrieve foundational data from covidtracking.com.
+        Rolling means, doubling times and weekly growth for every region of
+        the current cube, computed once per cube.
         """
-        base_url = BASE_API_URL
-        url = '/'.join([base_url,endpoint])
-        r = requests.get(url)
-        data = r.json()
-        return data
+        cube = self.cube()
+        with self._cube_lock:
+            if self._analytics_cube is not cube:
+                with span('rolling.build'):
+                    self._analytics = RollingAnalytics(cube)
+                self._analytics_cube = cube
+            return self._analytics
 
-    def make_bar_figures(self, region):
+    def make_bar_figures(self, region, smoothing=7, zoom=None):
         """
         Makes three figure plotly subplot with these metrics:
          - Daily new cases
          - Daily new tests administered
          - Daily positive test rate
+
+        Daily counts are overlaid with their smoothing-day rolling mean
+        unless smoothing is None. Returns the figure as a plain dict whose
+        nested parts are shared with the template, so it must not be
+        modified.
+
+        Long series are decimated; zoom=(axis, start, end), e.g. ('x3',
+        '2020-04-01', '2020-05-01'), sends the traces on that x axis at
+        full resolution within the range instead.
         """
+        dates, series, region_name = self._bar_series(region, smoothing)
+        return self._bar_figure(region_name, dates, series, smoothing, zoom)
 
-        if region == 'US':
-            data = self.get_data('states/daily.json')
-        else:
-            lowercase_state = region.lower()
-            data = self.get_data('states/{}/daily.json'.format(lowercase_state))
-            region = self.state_mapping[region]
+    def bar_series(self, region, smoothing=7):
+        """
+        The arrays behind a region's bar figure, for storing alongside an
+        export so zoomed figures can be built without the dataset.
+        """
+        dates, series, region_name = self._bar_series(region, smoothing)
+        return {'region': region_name, 'smoothing': smoothing, 'dates': dates, 'series': series}
 
-        df = pd.DataFrame(data)
-        df['date'] = pd.to_datetime(df['date'],format = '%Y%m%d')
-        df = df[df['date']>='2020-03-01']
-        df = df.sort_values(by='date')
+    def make_bar_figures_from_series(self, bar_series, zoom=None):
+        """
+        make_bar_figures() from the decoded JSON of bar_series().
+        """
+        dates = np.array(bar_series['dates'])
+        # nulls in the JSON come back as NaN
+        series = {column: np.array(values, dtype='float64') for column, values in bar_series['series'].items()}
+        return self._bar_figure(bar_series['region'], dates, series, bar_series['smoothing'], zoom)
 
-        if region == 'US':
-            total_df = df.groupby('date').sum().reset_index()
-            positive_rate_df = df[df.dataQualityGrade.isin(['A','A+'])].groupby('date').sum().reset_index()
-        else:
-            total_df = df
-            positive_rate_df = df[df.dataQualityGrade.isin(['A','A+'])]
+    @traced('bar.aggregate')
+    def _bar_series(self, region, smoothing=None):
+        cube = self.cube()
+        start = np.searchsorted(cube.dates, np.datetime64('2020-03-01'))
+        # ISO date strings, since the figure JSON encoder would turn
+        # datetime64 arrays into integers
+        dates = np.datetime_as_string(cube.dates[start:], unit='D')
+        series = {metric: np.maximum(cube.series(metric, region)[start:], 0) for metric in BAR_METRICS}
+        series['positive_rate'] = cube.series('positive_rate', region)[start:]
+        if smoothing:
+            analytics = self.analytics()
+            for metric in BAR_METRICS:
+                series[metric + '_mean'] = analytics.mean(metric, region, smoothing)[start:]
+        if region != 'US':
+            region = self.state_mapping[region]
+        return dates, series, region
 
-        positive_rate_df['positive_rate'] = positive_rate_df['positiveIncrease']/positive_rate_df['totalTestResultsIncrease']
+    def _bar_template(self, smoothing):
+        """
+        The bar figure as plotly JSON with empty traces and '{region}' in
+        its subplot titles. Built and validated by plotly once per
+        smoothing window and reused for every region.
+        """
+        with self._bar_templates_lock:
+            template = self._bar_templates.get(smoothing)
+            if template is None:
+                template = self._bar_templates[smoothing] = self._build_bar_template(smoothing)
+            return template
 
+    def _build_bar_template(self, smoothing):
         fig = make_subplots(
             rows=5,
             cols=1,
             subplot_titles=(
-                "Daily New Cases - {}".format(region),
-                "Daily New Tests Administered - {}".format(region),
-                "Daily New Hospitalizations - {}".format(region),
-                "Daily New Deaths - {}".format(region),
-                "Daily Positive Test Rate - {}".format(region)
+                "Daily New Cases - {region}",
+                "Daily New Tests Administered - {region}",
+                "Daily New Hospitalizations - {region}",
+                "Daily New Deaths - {region}",
+                "Daily Positive Test Rate - {region}"
             ),
             x_title="Date",
             vertical_spacing=0.05
         )
-        fig.add_trace(
-            go.Bar(
-                x=total_df['date'],
-                y=total_df['positiveIncrease'].clip(lower=0),
-                name=""
-            ),
-            row=1,
-            col=1
-        )
-        fig.add_trace(
-            go.Bar(
-                x=total_df['date'],
-                y=total_df['totalTestResultsIncrease'].clip(lower=0),
-                name=""
-            ),
-            row=2,
-            col=1
-        )
-        fig.add_trace(
-            go.Bar(
-                x=total_df['date'],
-                y=total_df['hospitalizedIncrease'].clip(lower=0),
-                name=""
-            ),
-            row=3,
-            col=1
-        )
-        fig.add_trace(
-            go.Bar(
-                x=total_df['date'],
-                y=total_df['deathIncrease'].clip(lower=0),
-                name=""
-            ),
-            row=4,
-            col=1
-        )
-        fig.add_trace(
-            go.Bar(
-                x=positive_rate_df['date'],
-                y=positive_rate_df['positive_rate'],
-                name=""
-            ),
-            row=5,
-            col=1
-        )
+        for row in range(1, len(BAR_TRACE_COLUMNS) + 1):
+            fig.add_trace(go.Bar(name=""), row=row, col=1)
+        if smoothing:
+            for row, metric in enumerate(BAR_METRICS, start=1):
+                fig.add_trace(
+                    go.Scatter(
+                        mode='lines',
+                        line={'color': '#222'},
+                        name="{}-Day Average".format(smoothing)
+                    ),
+                    row=row,
+                    col=1
+                )
         fig.update_yaxes(title_text="Confirmed Cases", row=1, col=1)
         fig.update_yaxes(title_text="Tests Administered", row=2, col=1)
         fig.update_yaxes(title_text="Confirmed Hospitalizations", row=3, col=1)
@@ -129,7 +455,33 @@ class PlotlyFigs:
             showlegend=False,
             height = 2400
         )
-        return fig
+        return fig.to_plotly_json()
+
+    @traced('bar.figure')
+    def _bar_figure(self, region, dates, series, smoothing=None, zoom=None):
+        """
+        Fill the template with one region's arrays and titles. The arrays
+        go to the JSON encoder as they are, without per-element validation.
+        """
+        template = self._bar_template(smoothing)
+        columns = list(BAR_TRACE_COLUMNS)
+        if smoothing:
+            columns += [metric + '_mean' for metric in BAR_METRICS]
+        data = []
+        for trace, column in zip(template['data'], columns):
+            x, y = dates, series[column]
+            if zoom is not None and trace.get('xaxis', 'x') == zoom[0]:
+                x, y = window(x, y, zoom[1], zoom[2])
+            x, y = decimate(x, y, 'minmax' if trace['type'] == 'bar' else 'lttb')
+            data.append(dict(trace, x=x, y=y))
+        layout = dict(template['layout'])
+        # keeps the user's zoom when a refined figure replaces this one
+        layout['uirevision'] = region
+        layout['annotations'] = [
+            dict(annotation, text=annotation['text'].replace('{region}', region))
+            for annotation in layout['annotations']
+        ]
+        return {'data': data, 'layout': layout}
 
     def make_map_figures(self):
         """
@@ -138,31 +490,39 @@ class PlotlyFigs:
          - Tests per capita
          - Positive test rate
         """
-        data = self.get_data('states/daily.json')
-        for state in data:
-            state['state_name'] = self.state_mapping[state['state']]
-        raw_df = pd.DataFrame(data)
+        total_df, positive_rate_df = self._map_frames()
+        return self._map_figures(total_df, positive_rate_df)
 
-        # get geojson data for use in mapping states
-        geojson = requests.get('https://eric.clst.org/assets/wiki/uploads/Stuff/gz_2010_us_040_00_500k.json')
-        states_geo = geojson.json()
-
-        # get state population data from census.gov
-        states_pop = self.state_pop
-        states_pop_df = pd.DataFrame(states_pop['data'])
-        df = pd.merge(raw_df,states_pop_df,left_on='state_name',right_on='State')
+    @traced('maps.aggregate')
+    def _map_frames(self):
+        cube = self.cube()
+        known = ~np.isnan(cube.population)
 
         # totals
-        total_df = df.groupby(['state_name','Population']).sum().reset_index()
-        total_df['positives_per_capita'] = total_df['positive']/total_df['Population']
-        total_df['positives_per_million'] = total_df['positives_per_capita']*1000000
-        total_df['tests_per_capita'] = total_df['totalTestResults']/total_df['Population']
-        total_df['tests_per_million'] = total_df['tests_per_capita']*1000000
+        totals = np.nansum(cube.values[:, :, [cube.metric_index['positive'], cube.metric_index['totalTestResults']]], axis=0)
+        total_df = pd.DataFrame({
+            'state_name': cube.state_names[known],
+            'positives_per_million': totals[known, 0] / cube.population[known] * 1000000,
+            'tests_per_million': totals[known, 1] / cube.population[known] * 1000000
+        })
 
         # positive rate
-        positive_rate_df = df[df.dataQualityGrade.isin(['A','A+'])].groupby(['state_name','Population']).sum().reset_index()
-        positive_rate_df['positive_rate'] = positive_rate_df['positive']/positive_rate_df['totalTestResults']
-        positive_rate_df['positives_per_hundred_tests'] = positive_rate_df['positive_rate']*100
+        graded_totals = cube.graded_sum(['positive', 'totalTestResults'], axis=0)
+        positive_rate_df = pd.DataFrame({
+            'state_name': cube.state_names[known],
+            'positives_per_hundred_tests': graded_totals[known, 0] / graded_totals[known, 1] * 100
+        })
+        return total_df, positive_rate_df
+
+    @traced('maps.figure')
+    def _map_figures(self, total_df, positive_rate_df):
+        # plotly.express is slow to import and only needed once data has
+        # loaded, so workers do not pay for it at boot
+        import plotly.express as px
+
+        # bundled, pre-simplified state outlines keyed by properties.NAME,
+        # referenced by URL so the three figures share one browser download
+        states_geo = geometry_url()
 
         layout_dict = {'font': FIG_FONT_DICT}
 
@@ -212,28 +572,106 @@ class PlotlyFigs:
         ])
         return graphs_div
 
+    def make_trend_comparison(self):
+        """
+        Makes a two subplot comparison of every state as of the latest day:
+         - 7-day average new cases per million people
+         - Week-over-week change in new cases
+        States are ordered by the first metric and the hover text carries
+        the current case doubling time.
+        """
+        return self._trend_figure(self._trend_frame())
+
+    @traced('trends.aggregate')
+    def _trend_frame(self):
+        analytics = self.analytics()
+        # the last region column is the US total
+        known = ~np.isnan(analytics.population[:-1])
+        latest = len(analytics.dates) - 1
+        trend_df = pd.DataFrame({
+            'state_name': analytics.region_names[:-1][known],
+            'cases_per_million': analytics.mean_per_million('positiveIncrease')[latest, :-1][known],
+            'week_over_week': analytics.week_over_week['positiveIncrease'][latest, :-1][known],
+            'doubling_time': analytics.doubling_time[latest, :-1][known]
+        })
+        return trend_df.sort_values('cases_per_million', ascending=False)
+
+    @traced('trends.figure')
+    def _trend_figure(self, trend_df):
+        hover_text = [
+            "Doubling time: {:.0f} days".format(days) if days == days else "Doubling time: not growing"
+            for days in trend_df['doubling_time']
+        ]
+        fig = make_subplots(
+            rows=2,
+            cols=1,
+            subplot_titles=(
+                "7-Day Average New Cases per Million People",
+                "Week-over-Week Change in New Cases"
+            ),
+            vertical_spacing=0.2
+        )
+        fig.add_trace(
+            go.Bar(
+                x=trend_df['state_name'],
+                y=trend_df['cases_per_million'],
+                hovertext=hover_text,
+                name=""
+            ),
+            row=1,
+            col=1
+        )
+        fig.add_trace(
+            go.Bar(
+                x=trend_df['state_name'],
+                y=trend_df['week_over_week'],
+                hovertext=hover_text,
+                name=""
+            ),
+            row=2,
+            col=1
+        )
+        fig.update_yaxes(title_text="Cases per Million", row=1, col=1)
+        fig.update_yaxes(title_text="Change", tickformat = ',.0%', row=2, col=1)
+        fig.update_layout(
+            font=FIG_FONT_DICT,
+            showlegend=False,
+            height = 1200
+        )
+        return fig
+
     def make_state_growth_plots(self):
-        data = self.get_data('states/daily.json')
-        for state in data:
-            state['state_name'] = self.state_mapping[state['state']]
-        raw_df = pd.DataFrame(data)
-        raw_df['date'] = pd.to_datetime(raw_df['date'],format = '%Y%m%d')
+        df_non_nulls_hundredth, df_non_nulls_per_capita = self._growth_frames()
+        return self._growth_figures(df_non_nulls_hundredth, df_non_nulls_per_capita)
 
-        # get state population data from census.gov
-        states_pop = self.state_pop
-        states_pop_df = pd.DataFrame(states_pop['data'])
-        df = pd.merge(raw_df,states_pop_df,left_on='state_name',right_on='State')
+    @traced('growth.aggregate')
+    def _growth_frames(self):
+        cube = self.cube()
+        offsets = self.growth_offsets()
 
-        df['tests_per_capita'] = df['totalTestResults']/df['Population']
-        df['positives_per_capita'] = df['positive']/df['Population']
-        df['positives_per_million'] = df['positives_per_capita']*1000000
+        def frame(days_column, metric):
+            days = offsets[days_column]
+            keep = days >= 0
+            # decimate the few states whose curves are long enough, on a
+            # log scale to match the axes
+            for state_code in np.nonzero(keep.sum(axis=0) > DECIMATE_POINTS)[0]:
+                rows = np.nonzero(keep[:, state_code])[0]
+                keep[:, state_code] = False
+                keep[rows[lttb_indices(np.log10(cube[metric][rows, state_code]), DECIMATE_POINTS)], state_code] = True
+            date_codes, state_codes = np.nonzero(keep)
+            return pd.DataFrame({
+                'state_name': cube.state_names[state_codes],
+                days_column: days[date_codes, state_codes],
+                metric: cube[metric][date_codes, state_codes]
+            })
 
-        df = df.sort_values(by='date')
-        df['days_since_hundredth_case'] = df[df['positive']>=100].groupby(['state']).cumcount()
-        df['days_since_10_per_million'] = df[df['positives_per_million']>=10].groupby(['state']).cumcount()
+        df_non_nulls_hundredth = frame('days_since_hundredth_case', 'positive')
+        df_non_nulls_per_capita = frame('days_since_10_per_million', 'positives_per_million')
+        return df_non_nulls_hundredth, df_non_nulls_per_capita
 
-        df_non_nulls_hundredth = df[df['days_since_hundredth_case'].notnull()]
-        df_non_nulls_per_capita = df[df['days_since_10_per_million'].notnull()]
+    @traced('growth.figure')
+    def _growth_figures(self, df_non_nulls_hundredth, df_non_nulls_per_capita):
+        import plotly.express as px
 
         fig = px.scatter(
             df_non_nulls_hundredth,
@@ -241,7 +679,8 @@ class PlotlyFigs:
             y='positive',
             color='state_name',
             labels = {'days_since_hundredth_case':'Days Since 100th Positive','positive':'Total Positives'},
-            log_y=True
+            log_y=True,
+            render_mode='webgl'
         )
 
         for trace in fig.data:
@@ -253,7 +692,8 @@ class PlotlyFigs:
             y='positives_per_million',
             color='state_name',
             labels = {'days_since_10_per_million':'Days Since 10 Positive per Million','positives_per_million':'Positives per Million People'},
-            log_y=True
+            log_y=True,
+            render_mode='webgl'
         )
 
         for trace in fig_per_capita.data:
@@ -0,0 +1,108 @@
+import fcntl
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+INDEX_KEY = 'refresher:generation-index'
+
+class BackgroundRefresher:
+    """
+    Keeps a set of cached values current from a background thread so
+    requests always read the last good version instead of rebuilding.
+
+    Values are content-addressed: keys() returns the cache key of every
+    value for the data this process holds, and an index in the shared cache
+    maps each name to its key. A refresh builds only the values whose key
+    has changed and then replaces the index in one write, so a new upstream
+    version switches every affected value at once and unchanged data is
+    never rebuilt. An exclusive file lock makes sure only one gunicorn
+    worker refreshes at a time.
+
+    keys() also returns a generation, the time its data was last known to
+    be current. The index is never replaced by one of an older generation,
+    so a worker whose download failed cannot roll the others back. The
+    index also records code_version, and an index written by other code
+    (an earlier deploy, whose values this code cannot use) is always
+    replaced and never read.
+    """
+
+    def __init__(self, cache, keys, build, interval, lock_path, code_version=None):
+        self.cache = cache
+        self.keys = keys
+        self.build = build
+        self.interval = interval
+        self.lock_path = lock_path
+        self.code_version = code_version
+        self._cold_keys = {}
+        self._thread = None
+
+    def get(self, name, build):
+        """
+        Return the current value for name. On a cold cache build() is
+        called inline and returns (key, value); a None value means it
+        cannot be built yet, and is passed on and not cached. Inline builds
+        are found again by key until the index names the value.
+        """
+        index = self._current_index()
+        key = index['keys'].get(name) if index is not None else self._cold_keys.get(name)
+        value = self.cache.get(key) if key is not None else None
+        if value is None:
+            key, value = build()
+            if value is not None:
+                self.cache.set(key, value, timeout=0)
+                self._cold_keys[name] = key
+        return value
+
+    def refresh(self):
+        """
+        Rebuild the values whose keys changed, unless another process holds
+        the lock. Returns the number of values rebuilt.
+        """
+        with open(self.lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            try:
+                generation, keys = self.keys()
+                previous = self._current_index() or {'generation': None, 'keys': {}}
+                if previous['generation'] is not None and (generation is None or generation < previous['generation']):
+                    logger.warning('Holding older data than the shared index, leaving it in place')
+                    return 0
+                stale = [name for name, key in keys.items() if previous['keys'].get(name) != key]
+                if stale:
+                    values = self.build(stale)
+                    self.cache.set_many({keys[name]: value for name, value in values.items()}, timeout=0)
+                self.cache.set(INDEX_KEY, {
+                    'code_version': self.code_version,
+                    'generation': generation,
+                    'keys': keys
+                }, timeout=0)
+                return len(stale)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _current_index(self):
+        """
+        The shared index if it was written by this code version, else None.
+        """
+        index = self.cache.get(INDEX_KEY)
+        if index is None or index.get('code_version') != self.code_version:
+            return None
+        return index
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('Background refresh failed, serving last good values')
+            time.sleep(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='figure-refresher', daemon=True)
+            self._thread.start()
+        return self._thread
@@ -0,0 +1,110 @@
+import numpy as np
+
+ROLLING_WINDOWS = (7, 14)
+
+ROLLING_METRICS = [
+    'positiveIncrease',
+    'totalTestResultsIncrease',
+    'hospitalizedIncrease',
+    'deathIncrease'
+]
+
+GROWTH_METRICS = [
+    'positiveIncrease',
+    'deathIncrease'
+]
+
+def _shifted_difference(cumsum, window):
+    """
+    cumsum[t] - cumsum[t - window] along the date axis, with the first
+    window - 1 rows differenced against zero.
+    """
+    previous = np.zeros_like(cumsum)
+    previous[window:] = cumsum[:-window]
+    return cumsum - previous
+
+def rolling_sum(values, window, min_periods=None):
+    """
+    Trailing window sums down the date axis of a date x region array,
+    ignoring NaN. Rows with fewer than min_periods values are NaN.
+    """
+    if min_periods is None:
+        min_periods = window
+    present = ~np.isnan(values)
+    sums = _shifted_difference(np.cumsum(np.where(present, values, 0), axis=0), window)
+    counts = _shifted_difference(np.cumsum(present, axis=0), window)
+    return np.where(counts >= min_periods, sums, np.nan)
+
+def rolling_mean(values, window, min_periods=None):
+    if min_periods is None:
+        min_periods = window
+    present = ~np.isnan(values)
+    counts = _shifted_difference(np.cumsum(present, axis=0), window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return rolling_sum(values, window, min_periods) / counts
+
+def lagged(values, lag):
+    shifted = np.full_like(values, np.nan)
+    shifted[lag:] = values[:-lag]
+    return shifted
+
+def doubling_time(cumulative, window=7):
+    """
+    Days for a cumulative series to double at the growth rate of the last
+    window days. NaN where the series did not grow.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = np.log(cumulative / lagged(cumulative, window))
+        return np.where(growth > 0, window * np.log(2) / growth, np.nan)
+
+def week_over_week(increases):
+    """
+    Growth of the last seven days' total over the seven days before.
+    """
+    weekly = rolling_sum(increases, 7)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = weekly / lagged(weekly, 7) - 1
+    return np.where(np.isfinite(growth), growth, np.nan)
+
+class RollingAnalytics:
+    """
+    Smoothed and derived series for every state and the US, computed in one
+    vectorized pass per metric over date x region arrays. The US is the
+    last region column.
+    """
+
+    def __init__(self, cube):
+        self.dates = cube.dates
+        self.regions = list(cube.states) + ['US']
+        self.region_index = {region: i for i, region in enumerate(self.regions)}
+        self.region_names = np.append(cube.state_names, 'US')
+        self.population = np.append(cube.population, np.nansum(cube.population))
+
+        self.means = {}
+        for metric in ROLLING_METRICS:
+            values = regional(cube, metric)
+            for window in ROLLING_WINDOWS:
+                self.means[metric, window] = rolling_mean(values, window)
+        self.doubling_time = doubling_time(regional(cube, 'positive'))
+        self.week_over_week = {metric: week_over_week(regional(cube, metric)) for metric in GROWTH_METRICS}
+
+    def mean(self, metric, region, window=7):
+        return self._region(self.means[metric, window], region)
+
+    def mean_per_million(self, metric, window=7):
+        """
+        Rolling means of a metric scaled by every region's population.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.means[metric, window] / self.population * 1000000
+
+    def _region(self, values, region):
+        if region not in self.region_index:
+            return np.full(len(self.dates), np.nan)
+        return values[:, self.region_index[region]]
+
+def regional(cube, metric):
+    """
+    A date x region array of a base metric: every state, then the US total.
+    """
+    return np.column_stack([cube[metric], cube.series(metric, 'US')])
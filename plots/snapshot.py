@@ -0,0 +1,208 @@
+import fcntl
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+META_FILE = 'meta.json'
+LOCK_FILE = '.lock'
+
+# bumped when the file layout changes; older snapshots are started afresh
+SNAPSHOT_FORMAT = 3
+
+CATEGORY_CODE_DTYPE = 'int16'
+
+class SnapshotStore:
+    """
+    On-disk columnar copy of the per-state daily time series.
+
+    Each column is a raw binary file of fixed-width values; categorical
+    columns are stored as codes with their categories in meta.json. New
+    rows are written at the end of each file in the order they arrive;
+    meta.json keeps each state's last stored date, so a state that reports
+    a day late still gets its row appended. meta.json is replaced last and
+    records how many rows are complete, which lets readers in other
+    processes ignore a partially written append. A full rewrite goes to files of a new
+    generation. Writes from several processes are serialized with a file
+    lock, which readers share while opening the files.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _column_path(self, column, generation):
+        return os.path.join(self.path, '{}.{}.bin'.format(column, generation))
+
+    def _read_meta(self):
+        with open(os.path.join(self.path, META_FILE)) as f:
+            return json.load(f)
+
+    def _write_meta(self, meta):
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix=META_FILE + '.')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(self.path, META_FILE))
+
+    def _current_meta(self):
+        if not os.path.exists(os.path.join(self.path, META_FILE)):
+            return None
+        meta = self._read_meta()
+        return meta if meta.get('format') == SNAPSHOT_FORMAT else None
+
+    def exists(self):
+        return self._current_meta() is not None
+
+    def updated_at(self):
+        return self._read_meta()['updated_at']
+
+    def last_dates(self):
+        """
+        {state: last stored date}, empty before the first write.
+        """
+        meta = self._current_meta()
+        if meta is None:
+            return {}
+        return {state: pd.Timestamp(date) for state, date in meta['last_dates'].items()}
+
+    def replaced_at(self):
+        """
+        When the stored series was last replaced by a full download, or
+        None before the first.
+        """
+        meta = self._current_meta()
+        return meta.get('replaced_at') if meta is not None else None
+
+    def load(self):
+        """
+        The stored series as a DataFrame with the dtypes it was stored with.
+        Numeric columns are read-only memory maps of the column files,
+        which pandas 1.5+ keeps without copying; older pandas consolidates
+        them into one copied block. Files are opened under a shared lock, so
+        a concurrent replace() cannot remove them in between.
+        """
+        with self._lock(fcntl.LOCK_SH):
+            meta = self._read_meta()
+            rows = meta['rows']
+            columns = {}
+            for column, dtype in meta['columns'].items():
+                path = self._column_path(column, meta['generation'])
+                if dtype == 'category':
+                    codes = np.fromfile(path, dtype=CATEGORY_CODE_DTYPE, count=rows)
+                    categories = meta['categories'].get(column, [])
+                    categorical = pd.Categorical.from_codes(codes, categories=categories)
+                    # sorted like freshly parsed columns, so the two concatenate
+                    columns[column] = categorical.reorder_categories(sorted(categories))
+                elif rows:
+                    columns[column] = np.memmap(path, dtype=dtype, mode='r', shape=(rows,))
+                else:
+                    columns[column] = np.empty(0, dtype=dtype)
+        return pd.DataFrame(columns, columns=list(meta['columns']), copy=False)
+
+    def append(self, df):
+        """
+        Append the rows of df dated after the last stored date of their
+        state. Returns the number of rows written.
+        """
+        return self._write(df, replace=False)
+
+    def replace(self, df):
+        """
+        Replace the stored series with df, e.g. after a full download that
+        may have revised earlier dates. Returns the number of rows written.
+        """
+        return self._write(df, replace=True)
+
+    def _write(self, df, replace):
+        os.makedirs(self.path, exist_ok=True)
+        with self._lock(fcntl.LOCK_EX):
+            return self._write_locked(df, replace)
+
+    @contextmanager
+    def _lock(self, operation):
+        with open(os.path.join(self.path, LOCK_FILE), 'a') as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_locked(self, df, replace):
+        meta = previous = self._current_meta()
+        if replace or meta is None:
+            meta = {
+                'format': SNAPSHOT_FORMAT,
+                'generation': previous['generation'] + 1 if previous is not None else 0,
+                'rows': 0,
+                'columns': {column: _stored_dtype(df[column]) for column in df.columns},
+                'categories': {},
+                'last_dates': {},
+                'replaced_at': time.time() if replace else None
+            }
+        else:
+            df = rows_after(df, {state: pd.Timestamp(date) for state, date in meta['last_dates'].items()})
+        if df.empty:
+            return 0
+        df = df.sort_values(by=['date', 'state'])
+
+        for column, dtype in meta['columns'].items():
+            if dtype == 'category':
+                categories = meta['categories'].setdefault(column, [])
+                values = _category_codes(df[column], categories)
+            else:
+                values = np.asarray(df[column], dtype=dtype)
+            with open(self._column_path(column, meta['generation']), 'ab') as f:
+                # drop anything past the recorded rows, left by an append
+                # that failed before meta.json was replaced
+                f.truncate(meta['rows'] * values.dtype.itemsize)
+                f.write(values.tobytes())
+
+        meta['rows'] += len(df)
+        for state, date in df.groupby('state', observed=True)['date'].max().items():
+            meta['last_dates'][state] = str(date.date())
+        meta['updated_at'] = time.time()
+        self._write_meta(meta)
+        if previous is not None and previous['generation'] != meta['generation']:
+            for column in previous['columns']:
+                _remove(self._column_path(column, previous['generation']))
+        return len(df)
+
+def rows_after(df, last_dates):
+    """
+    The rows of df dated after the last date of their own state in
+    {state: date}. States not in last_dates keep every row.
+    """
+    last = pd.to_datetime(df['state'].astype(object).map(last_dates))
+    # comparisons with NaT are False, so unknown states are kept
+    return df[~(df['date'] <= last)]
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _stored_dtype(series):
+    if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_datetime64_dtype(series):
+        return str(series.dtype)
+    return 'category'
+
+def _category_codes(series, categories):
+    """
+    Codes of series against categories, extending categories in place
+    with values not seen before. Missing values are -1.
+    """
+    series = series.astype('category')
+    index = {category: code for code, category in enumerate(categories)}
+    mapping = np.empty(len(series.cat.categories) + 1, dtype=CATEGORY_CODE_DTYPE)
+    for i, category in enumerate(series.cat.categories):
+        if category not in index:
+            index[category] = len(categories)
+            categories.append(category)
+        mapping[i] = index[category]
+    # the series' own code -1 (missing) picks the trailing -1
+    mapping[-1] = -1
+    return mapping[series.cat.codes.to_numpy()]
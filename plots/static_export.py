@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+
+STATIC_MANIFEST = 'manifest.json'
+
+# versions kept on disk so clients that read the previous manifest can still
+# fetch its files while a new export is published
+STATIC_KEEP_VERSIONS = 2
+
+# versions are truncated sha1 hex digests, see payload_version()
+STATIC_VERSION_PATTERN = re.compile(r'^[0-9a-f]{16}$')
+
+ENCODING_SUFFIXES = {
+    'br': '.br',
+    'gzip': '.gz'
+}
+
+def static_name(output, value):
+    """
+    Relative file name of a callback response for one input value.
+    """
+    return '{}/{}.json'.format(output, value)
+
+def payload_version(payloads):
+    """
+    Content hash of a set of payloads, so an export of unchanged data gets
+    the same version.
+    """
+    digest = hashlib.sha1()
+    for name in sorted(payloads):
+        digest.update(name.encode('utf-8'))
+        digest.update(payloads[name].raw)
+    return digest.hexdigest()[:16]
+
+class StaticFigureStore:
+    """
+    Directory of pre-rendered callback responses, one immutable
+    subdirectory per version holding every payload raw, gzipped and
+    brotli-compressed, plus a manifest naming the current version.
+
+    The files can be served as they are by the app or by any static file
+    server, without importing pandas or plotly.
+    """
+
+    def __init__(self, path, revalidate_interval=1):
+        self.path = path
+        self.revalidate_interval = revalidate_interval
+        self._manifest = None
+        self._mtime = None
+        self._checked_at = 0
+
+    def manifest_path(self):
+        return os.path.join(self.path, STATIC_MANIFEST)
+
+    def write(self, payloads, data_version=None):
+        """
+        Publish {name: Payload} built from data_version as a new version and
+        return it. The version directory is complete before the manifest
+        points to it.
+        """
+        version = payload_version(payloads)
+        version_dir = os.path.join(self.path, version)
+        if not os.path.isdir(version_dir):
+            os.makedirs(self.path, exist_ok=True)
+            tmp_dir = tempfile.mkdtemp(dir=self.path, prefix='.tmp-')
+            os.chmod(tmp_dir, 0o755)
+            for name, payload in payloads.items():
+                file_path = os.path.join(tmp_dir, name)
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                _write(file_path, payload.raw)
+                _write(file_path + ENCODING_SUFFIXES['gzip'], payload.gzip)
+                if payload.br is not None:
+                    _write(file_path + ENCODING_SUFFIXES['br'], payload.br)
+            os.replace(tmp_dir, version_dir)
+
+        manifest = {
+            'version': version,
+            'data_version': data_version,
+            'files': sorted(payloads),
+            'updated_at': time.time()
+        }
+        tmp_path = self.manifest_path() + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path())
+        self._prune(version)
+        return version
+
+    def _prune(self, current):
+        versions = [
+            entry for entry in os.listdir(self.path)
+            if entry != current and not entry.startswith('.') and os.path.isdir(os.path.join(self.path, entry))
+        ]
+        versions.sort(key=lambda entry: os.path.getmtime(os.path.join(self.path, entry)), reverse=True)
+        for entry in versions[STATIC_KEEP_VERSIONS - 1:]:
+            shutil.rmtree(os.path.join(self.path, entry), ignore_errors=True)
+
+    def manifest(self):
+        """
+        The current manifest, re-read when the file changes and checked at
+        most every revalidate_interval seconds. None before the first export.
+        """
+        now = time.time()
+        if now - self._checked_at < self.revalidate_interval:
+            return self._manifest
+        self._checked_at = now
+        try:
+            mtime = os.path.getmtime(self.manifest_path())
+        except OSError:
+            self._manifest = self._mtime = None
+            return None
+        if mtime != self._mtime:
+            with open(self.manifest_path()) as f:
+                self._manifest = json.load(f)
+            self._manifest['names'] = set(self._manifest['files'])
+            self._mtime = mtime
+        return self._manifest
+
+    def has_version(self, version):
+        """
+        Whether version names an exported version still on disk. Anything
+        else, such as a path segment from a request, is rejected.
+        """
+        return bool(STATIC_VERSION_PATTERN.match(version)) and os.path.isdir(os.path.join(self.path, version))
+
+    def version(self):
+        manifest = self.manifest()
+        return manifest['version'] if manifest is not None else None
+
+    def lookup(self, name, accept_encodings):
+        """
+        Path of the smallest stored encoding of name the client accepts and
+        its Content-Encoding (None for the raw file), or None if name is
+        not in the current version.
+        """
+        manifest = self.manifest()
+        if manifest is None or name not in manifest['names']:
+            return None
+        file_path = os.path.join(self.path, manifest['version'], name)
+        for encoding in ('br', 'gzip'):
+            if encoding in accept_encodings and os.path.exists(file_path + ENCODING_SUFFIXES[encoding]):
+                return file_path + ENCODING_SUFFIXES[encoding], encoding
+        return file_path, None
+
+def _write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
@@ -0,0 +1,104 @@
+import array
+import codecs
+import json
+
+import numpy as np
+import pandas as pd
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+JSON_WHITESPACE = ' \t\r\n'
+
+# array.array typecode for each column dtype; categories are stored as codes
+TYPECODES = {
+    'int32': 'i',
+    'float32': 'f',
+    'category': 'h'
+}
+
+def iter_json_array(chunks):
+    """
+    Yield the objects of a top-level JSON array from an iterable of byte
+    chunks, holding at most one chunk and one object in memory at a time.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+    opened = False
+    need_more = False
+    while True:
+        if need_more or pos >= len(buf):
+            chunk = next(chunks, None)
+            if chunk is None:
+                if need_more:
+                    raise ValueError('truncated JSON array')
+                buf = buf[pos:] + text.decode(b'', final=True)
+                pos = 0
+                if not buf.strip():
+                    raise ValueError('JSON array is not closed')
+            else:
+                buf = buf[pos:] + text.decode(chunk)
+                pos = 0
+            need_more = False
+            continue
+        char = buf[pos]
+        if char in JSON_WHITESPACE or (opened and char == ','):
+            pos += 1
+        elif not opened:
+            if char != '[':
+                raise ValueError('expected a JSON array')
+            opened = True
+            pos += 1
+        elif char == ']':
+            return
+        else:
+            try:
+                item, pos = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                need_more = True
+                continue
+            yield item
+
+class ColumnBuilder:
+    """
+    Accumulates selected fields of JSON rows straight into typed column
+    arrays, so the rows themselves can be dropped as soon as they are read.
+    """
+
+    def __init__(self, dtypes):
+        self.dtypes = dtypes
+        self._values = {column: array.array(TYPECODES[dtype]) for column, dtype in dtypes.items()}
+        self._categories = {column: {} for column, dtype in dtypes.items() if dtype == 'category'}
+
+    def add(self, row):
+        for column, dtype in self.dtypes.items():
+            value = row.get(column)
+            if dtype == 'category':
+                if value is None:
+                    value = -1
+                else:
+                    categories = self._categories[column]
+                    value = categories.setdefault(value, len(categories))
+            elif value is None:
+                value = float('nan')
+            self._values[column].append(value)
+
+    def columns(self):
+        """
+        Return {column: array or Categorical} viewing the accumulated buffers.
+        """
+        columns = {}
+        for column, dtype in self.dtypes.items():
+            values = self._values[column]
+            if dtype == 'category':
+                codes = np.frombuffer(values, dtype='int16')
+                categories = list(self._categories[column])
+                # sorted categories keep consecutive parses concatenable
+                # without falling back to object columns
+                categorical = pd.Categorical.from_codes(codes, categories=categories)
+                columns[column] = categorical.reorder_categories(sorted(categories))
+            else:
+                columns[column] = np.frombuffer(values, dtype=dtype)
+        return columns
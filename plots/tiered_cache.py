@@ -0,0 +1,120 @@
+import collections
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+import zlib
+
+COMPRESS_LEVEL = 1
+
+class TieredCache:
+    """
+    Two-tier cache: a per-process LRU bounded by bytes in front of a shared,
+    size-capped, compressed directory that every worker reads and writes.
+
+    Entries do not expire; they are replaced by newer writes and evicted by
+    size. A memory hit is served without touching the disk unless the entry
+    has not been checked for revalidate_interval seconds, in which case the
+    file's mtime is compared to catch writes from other processes.
+    """
+
+    def __init__(self, path, memory_bytes=64 * 2 ** 20, disk_bytes=512 * 2 ** 20, revalidate_interval=1):
+        self.path = path
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.revalidate_interval = revalidate_interval
+        self.memory_size = 0
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def _remember(self, key, value, size, mtime):
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self.memory_size -= old[1]
+            if size > self.memory_bytes:
+                return
+            self._memory[key] = [value, size, mtime, time.time()]
+            self.memory_size += size
+            while self.memory_size > self.memory_bytes:
+                _, (_, evicted_size, _, _) = self._memory.popitem(last=False)
+                self.memory_size -= evicted_size
+
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            self._memory.move_to_end(key)
+            if time.time() - entry[3] < self.revalidate_interval:
+                return entry[0]
+        try:
+            mtime = os.stat(self._file(key)).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        with self._lock:
+            if mtime != entry[2]:
+                return None
+            entry[3] = time.time()
+            return entry[0]
+
+    def get(self, key):
+        value = self._memory_get(key)
+        if value is not None:
+            return value
+        path = self._file(key)
+        try:
+            with open(path, 'rb') as f:
+                mtime = os.fstat(f.fileno()).st_mtime_ns
+                data = zlib.decompress(f.read())
+        except FileNotFoundError:
+            return None
+        value = pickle.loads(data)
+        self._remember(key, value, len(data), mtime)
+        return value
+
+    def _write(self, key, value):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        path = self._file(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(zlib.compress(data, COMPRESS_LEVEL))
+        os.replace(tmp_path, path)
+        self._remember(key, value, len(data), os.stat(path).st_mtime_ns)
+
+    def set(self, key, value, timeout=None):
+        self._write(key, value)
+        self.evict_disk()
+        return True
+
+    def set_many(self, mapping, timeout=None):
+        for key, value in mapping.items():
+            self._write(key, value)
+        self.evict_disk()
+        return list(mapping)
+
+    def disk_size(self):
+        return sum(entry.stat().st_size for entry in os.scandir(self.path) if entry.is_file())
+
+    def evict_disk(self):
+        """
+        Delete the least recently written files until the directory fits
+        in disk_bytes.
+        """
+        entries = [entry for entry in os.scandir(self.path) if entry.is_file() and not entry.name.endswith('.tmp')]
+        entries = sorted(entries, key=lambda entry: entry.stat().st_mtime_ns)
+        total = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if total <= self.disk_bytes:
+                break
+            total -= entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
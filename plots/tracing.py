@@ -0,0 +1,181 @@
+import collections
+import functools
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from plots.metrics import STAGE_SECONDS
+
+_local = threading.local()
+
+@contextmanager
+def span(name):
+    """
+    Time one pipeline stage. The duration always goes to the stage
+    histogram, and to the current request's trace when one is open.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(name).observe(elapsed)
+        trace = getattr(_local, 'trace', None)
+        if trace is not None:
+            trace[name] += elapsed
+
+def traced(name):
+    """
+    Decorator running the whole function inside span(name).
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def start_trace():
+    _local.trace = collections.defaultdict(float)
+
+def finish_trace():
+    """
+    Close the current thread's trace and return {stage: seconds}.
+    """
+    trace = getattr(_local, 'trace', None)
+    _local.trace = None
+    return dict(trace or {})
+
+def server_timing(trace):
+    """
+    Format a trace as a Server-Timing header value for browser dev tools.
+    """
+    return ', '.join('{};dur={:.1f}'.format(name, seconds * 1000) for name, seconds in trace.items())
+
+PROFILE_MARKER = 'armed'
+
+class SamplingProfiler:
+    """
+    Samples the stacks of the next N requests and writes them in the
+    collapsed format read by flamegraph.pl and speedscope.
+
+    request() leaves a marker file in output_dir, so it reaches whichever
+    gunicorn worker takes the next request: that worker claims the marker
+    with an atomic rename and profiles its next N requests. Captures are
+    written to the same directory, where any worker can list them. Nothing
+    runs until the profiler is armed, and the sampling thread exits once
+    the requested number of requests has been captured.
+    """
+
+    def __init__(self, output_dir, interval=0.005):
+        self.output_dir = output_dir
+        self.interval = interval
+        self._remaining = 0
+        self._unadmitted = 0
+        self._threads = set()
+        self._stacks = collections.Counter()
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    @property
+    def armed(self):
+        return self._unadmitted > 0
+
+    def marker_path(self):
+        return os.path.join(self.output_dir, PROFILE_MARKER)
+
+    def request(self, requests):
+        """
+        Ask any worker sharing output_dir to profile its next requests.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.output_dir, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as f:
+            f.write(str(requests))
+        os.replace(tmp_path, self.marker_path())
+
+    def _claim(self):
+        claimed = '{}.{}'.format(self.marker_path(), os.getpid())
+        try:
+            os.rename(self.marker_path(), claimed)
+        except FileNotFoundError:
+            return
+        try:
+            with open(claimed) as f:
+                requests = int(f.read())
+        except ValueError:
+            return
+        finally:
+            os.remove(claimed)
+        self.arm(requests)
+
+    def arm(self, requests):
+        with self._lock:
+            self._remaining = self._unadmitted = requests
+            self._stacks = collections.Counter()
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample, name='sampling-profiler', daemon=True)
+                self._sampler.start()
+
+    def begin_request(self):
+        if not self.armed and os.path.exists(self.marker_path()):
+            self._claim()
+        if self.armed:
+            with self._lock:
+                # requests beyond N that start while armed are not sampled,
+                # so the capture is written exactly once
+                if self._unadmitted > 0:
+                    self._unadmitted -= 1
+                    self._threads.add(threading.get_ident())
+
+    def end_request(self):
+        thread_id = threading.get_ident()
+        if thread_id not in self._threads:
+            return
+        with self._lock:
+            self._threads.discard(thread_id)
+            self._remaining -= 1
+            if self._remaining == 0:
+                self._dump()
+
+    def _sample(self):
+        while True:
+            frames = sys._current_frames()
+            with self._lock:
+                if not self.armed and not self._threads:
+                    self._sampler = None
+                    return
+                for thread_id in self._threads:
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        self._stacks[_collapse(frame)] += 1
+            time.sleep(self.interval)
+
+    def _dump(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, 'profile-{}-{}.folded'.format(int(time.time()), os.getpid()))
+        with open(path, 'w') as f:
+            for stack, count in self._stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+    def captures(self):
+        """
+        File names of the captures written by any worker, newest first.
+        """
+        try:
+            names = [name for name in os.listdir(self.output_dir) if name.endswith('.folded')]
+        except FileNotFoundError:
+            return []
+        return sorted(names, key=lambda name: os.path.getmtime(os.path.join(self.output_dir, name)), reverse=True)
+
+def _collapse(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
@@ -0,0 +1,127 @@
+import datetime
+import random
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from metadata.states import STATE_MAPPING, STATE_POP
+from plots.plotly_figs import PlotlyFigs, typed
+
+STATES = ['CA', 'NY', 'WA', 'GU']
+
+def api_rows(first_day, days, seed=0):
+    """
+    API-shaped rows for STATES, newest first like states/daily.json. Each
+    day's values depend only on the day and seed.
+    """
+    start = datetime.date(2020, 3, 1)
+    rows = []
+    for day in range(first_day, first_day + days):
+        rng = random.Random(seed * 1000 + day)
+        date = int((start + datetime.timedelta(days=day)).strftime('%Y%m%d'))
+        for state in STATES:
+            positive_increase = rng.randint(0, 40)
+            rows.append({
+                'date': date,
+                'state': state,
+                'positive': 20 * day + positive_increase,
+                'positiveIncrease': positive_increase,
+                'totalTestResults': 400 * day,
+                'totalTestResultsIncrease': rng.randint(0, 400),
+                'hospitalizedIncrease': rng.choice([None, rng.randint(0, 10)]),
+                'deathIncrease': rng.randint(0, 5),
+                'dataQualityGrade': rng.choice(['A+', 'A', 'B', None])
+            })
+    rows.reverse()
+    return rows
+
+def plotly_figs(df, parent=None):
+    figs = PlotlyFigs(STATE_MAPPING, STATE_POP)
+    figs.dataset._df = df
+    figs.dataset.parent = parent
+    return figs
+
+class IncrementalUpdateTest(unittest.TestCase):
+    """
+    Extending the cube, versions and growth offsets with appended days
+    must give what a full recompute over the whole history gives.
+    """
+
+    def setUp(self):
+        figs = plotly_figs(None)
+        self.parse = figs.dataset.parse
+        self.history = self.parse(api_rows(0, 30))
+        self.full = self.parse(api_rows(0, 35))
+
+    def extend(self, figs, first_day, days):
+        previous = figs.dataset.df
+        latest = self.parse(api_rows(first_day, days))
+        figs.dataset._df = typed(pd.concat([previous, latest], ignore_index=True))
+        figs.dataset.parent = previous
+
+    def assertSameResults(self, incremental, full):
+        incremental_cube, full_cube = incremental.cube(), full.cube()
+        np.testing.assert_array_equal(incremental_cube.dates, full_cube.dates)
+        np.testing.assert_array_equal(incremental_cube.values, full_cube.values)
+        np.testing.assert_array_equal(incremental_cube.graded, full_cube.graded)
+        np.testing.assert_array_equal(incremental_cube.national, full_cube.national)
+        np.testing.assert_array_equal(incremental_cube.national_positive_rate, full_cube.national_positive_rate)
+        self.assertEqual(incremental.versions(), full.versions())
+        incremental_offsets, full_offsets = incremental.growth_offsets(), full.growth_offsets()
+        self.assertEqual(set(incremental_offsets), set(full_offsets))
+        for column in full_offsets:
+            np.testing.assert_array_equal(incremental_offsets[column], full_offsets[column])
+
+    def test_appended_days_match_full_recompute(self):
+        incremental = plotly_figs(self.history)
+        incremental.growth_offsets()
+        incremental.versions()
+        self.extend(incremental, 30, 2)
+        incremental.growth_offsets()
+        incremental.versions()
+        self.extend(incremental, 32, 3)
+        self.assertSameResults(incremental, plotly_figs(self.full))
+
+    def test_previous_cube_is_unchanged_by_extending(self):
+        figs = plotly_figs(self.history)
+        previous = figs.cube()
+        values = previous.values.copy()
+        self.extend(figs, 30, 5)
+        figs.cube()
+        self.assertEqual(len(previous.dates), 30)
+        np.testing.assert_array_equal(previous.values, values)
+
+    def test_extending_one_cube_twice(self):
+        figs = plotly_figs(self.history)
+        previous = figs.cube()
+        first = previous.extend(self.parse(api_rows(30, 1, seed=1)))
+        second = previous.extend(self.parse(api_rows(30, 5)))
+        self.assertEqual(len(first.dates), 31)
+        self.assertIs(second.base, previous)
+        np.testing.assert_array_equal(second.values, plotly_figs(self.full).cube().values)
+
+    def test_changed_history_is_recomputed(self):
+        figs = plotly_figs(self.history)
+        figs.growth_offsets()
+        figs.dataset._df = self.full
+        figs.dataset.parent = None
+        self.assertSameResults(figs, plotly_figs(self.full))
+        self.assertIsNone(figs.cube().base)
+
+    def test_offsets_skipping_a_revised_cube_are_recomputed(self):
+        figs = plotly_figs(self.history)
+        figs.growth_offsets()
+        # a revised history reaches cube() but not growth_offsets(), as a
+        # zoom or a bar-only build does, then a day is appended to it
+        revised = self.history.copy()
+        revised['positive'] = revised['positive'] * 2
+        figs.dataset._df = revised
+        figs.dataset.parent = None
+        revised_cube = figs.cube()
+        self.extend(figs, 30, 1)
+        self.assertIs(figs.cube().base, revised_cube)
+        self.assertSameResults(figs, plotly_figs(figs.dataset.df))
+
+if __name__ == '__main__':
+    unittest.main()
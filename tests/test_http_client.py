@@ -0,0 +1,89 @@
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from plots.http_client import DataClient
+
+BODY = json.dumps([{'state': 'NY', 'positive': 1}]).encode('utf-8')
+
+def parse_stream(chunks):
+    return json.loads(b''.join(chunks))
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.path)
+        server.connections.add(self.client_address)
+        if self.path == '/etag' and self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.send_header('ETag', '"v1"')
+            self.end_headers()
+            return
+        if self.path == '/flaky' and server.requests.count('/flaky') == 1:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(BODY)))
+        if self.path == '/etag':
+            self.send_header('ETag', '"v1"')
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+class DataClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.server.requests = []
+        self.server.connections = set()
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.client = DataClient('http://127.0.0.1:{}'.format(self.server.server_port), backoff_factor=0)
+
+    def tearDown(self):
+        self.client.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_etag_revalidation(self):
+        first = self.client.get('etag')
+        second = self.client.get('etag')
+        self.assertFalse(first.not_modified)
+        self.assertTrue(second.not_modified)
+        self.assertIs(second.data, first.data)
+        self.assertEqual(second.version, '"v1"')
+
+    def test_streamed_not_modified_releases_connection(self):
+        first = self.client.get('etag', parser=parse_stream)
+        for _ in range(3):
+            response = self.client.get('etag', parser=parse_stream)
+            self.assertTrue(response.not_modified)
+            self.assertIs(response.data, first.data)
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_identical_body_without_etag(self):
+        for parser in (None, parse_stream):
+            client = DataClient('http://127.0.0.1:{}'.format(self.server.server_port))
+            first = client.get('plain', parser=parser)
+            second = client.get('plain', parser=parser)
+            self.assertFalse(first.not_modified)
+            self.assertTrue(second.not_modified)
+            self.assertIs(second.data, first.data)
+            self.assertEqual(second.version, first.version)
+            client.session.close()
+
+    def test_retries_server_errors(self):
+        response = self.client.get('flaky')
+        self.assertEqual(response.data, json.loads(BODY))
+        self.assertEqual(self.server.requests, ['/flaky', '/flaky'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+
+from plots.refresher import INDEX_KEY, BackgroundRefresher
+
+class DictCache:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.values[key] = value
+
+    def set_many(self, mapping, timeout=None):
+        self.values.update(mapping)
+
+class RefresherIndexTest(unittest.TestCase):
+    """
+    The shared index is never rolled back to older data by the same code,
+    and is always replaced by other code.
+    """
+
+    def setUp(self):
+        self.cache = DictCache()
+        lock_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(lock_dir.cleanup)
+        self.lock_path = os.path.join(lock_dir.name, 'refresher.lock')
+
+    def refresher(self, code_version, generation):
+        keys = {'figure': 'payload:figure:{}:{}'.format(code_version, generation)}
+        build = lambda names: {name: '{}@{}'.format(code_version, generation) for name in names}
+        return BackgroundRefresher(
+            self.cache, lambda: (generation, keys), build, 60, self.lock_path,
+            code_version=code_version
+        )
+
+    def test_older_generation_is_not_written(self):
+        self.refresher('v1', 20).refresh()
+        self.assertEqual(self.refresher('v1', 10).refresh(), 0)
+        self.assertEqual(self.cache.get(INDEX_KEY)['generation'], 20)
+
+    def test_other_code_version_replaces_newer_index(self):
+        self.refresher('v1', 20).refresh()
+        deployed = self.refresher('v2', 10)
+        self.assertEqual(deployed.refresh(), 1)
+        self.assertEqual(self.cache.get(INDEX_KEY)['code_version'], 'v2')
+        self.assertEqual(deployed.get('figure', lambda: (None, None)), 'v2@10')
+
+    def test_other_code_version_index_is_not_read(self):
+        self.refresher('v1', 20).refresh()
+        value = self.refresher('v2', 10).get('figure', lambda: ('cold', 'v2 inline'))
+        self.assertEqual(value, 'v2 inline')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from plots.http_client import DataResponse
+from plots.plotly_figs import StatesDataset, typed
+from plots.snapshot import SnapshotStore
+
+STATES = ['CA', 'GU', 'NY', 'WA']
+
+def api_rows(day, states=STATES):
+    """
+    API-shaped rows of one day, day 0 being 2020-03-01.
+    """
+    date = int((datetime.date(2020, 3, 1) + datetime.timedelta(days=day)).strftime('%Y%m%d'))
+    return [{
+        'date': date,
+        'state': state,
+        'positive': 100 * day + i,
+        'positiveIncrease': i,
+        'totalTestResults': 1000 * day,
+        'totalTestResultsIncrease': 10 * i,
+        'hospitalizedIncrease': None,
+        'deathIncrease': 1,
+        'dataQualityGrade': 'A'
+    } for i, state in enumerate(states)]
+
+def history(days):
+    return [row for day in reversed(range(days)) for row in api_rows(day)]
+
+class FakeClient:
+    """
+    Answers DataClient.get() from {endpoint: rows}, counting requests.
+    """
+
+    def __init__(self):
+        self.rows = {}
+        self.requests = []
+
+    def get(self, endpoint, parser=None):
+        self.requests.append(endpoint)
+        data = parser([json.dumps(self.rows[endpoint]).encode('utf-8')])
+        return DataResponse(data, None, False)
+
+def state_dates(df):
+    return sorted(
+        (state, str(date.date()))
+        for state, date in zip(df['state'].astype(object), df['date'])
+    )
+
+class SnapshotTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.store = SnapshotStore(self.path)
+        self.parse = StatesDataset(None).parse
+
+class SnapshotStoreTest(SnapshotTestCase):
+
+    def test_append_keeps_rows_after_each_states_last_date(self):
+        self.assertEqual(self.store.append(self.parse(history(3))), 12)
+        self.assertEqual(self.store.append(self.parse(api_rows(3, ['CA', 'NY']) + api_rows(2, ['WA', 'GU']))), 2)
+        self.assertEqual(self.store.append(self.parse(api_rows(3))), 2)
+        self.assertEqual(self.store.append(self.parse(api_rows(3))), 0)
+        expected = self.parse(history(4))
+        self.assertEqual(state_dates(self.store.load()), state_dates(expected))
+        self.assertEqual(self.store.last_dates(), {state: pd.Timestamp('2020-03-04') for state in STATES})
+
+    def test_load_round_trips_dtypes(self):
+        df = self.parse(history(3))
+        self.store.append(df)
+        loaded = typed(self.store.load())
+        self.assertEqual(loaded.dtypes.to_dict(), df.dtypes.to_dict())
+        self.assertEqual(list(loaded['state'].cat.categories), STATES)
+        np.testing.assert_array_equal(
+            loaded.sort_values(['date', 'state'])['positive'].to_numpy(),
+            df.sort_values(['date', 'state'])['positive'].to_numpy()
+        )
+
+    def test_replace_starts_a_new_generation(self):
+        self.store.append(self.parse(history(3)))
+        self.assertEqual(self.store.replace(self.parse(api_rows(5, ['WA']))), 1)
+        self.assertEqual(state_dates(self.store.load()), [('WA', '2020-03-06')])
+        self.assertEqual(self.store.last_dates(), {'WA': pd.Timestamp('2020-03-06')})
+        self.assertIsNotNone(self.store.replaced_at())
+        self.assertTrue(all(name.split('.')[1] == '1' for name in os.listdir(self.path) if name.endswith('.bin')))
+
+    def test_load_maps_numeric_columns(self):
+        self.store.append(self.parse(history(3)))
+        loaded = self.store.load()
+        self.store.replace(self.parse(api_rows(5)))
+        # the previous generation's files are gone, its maps still read
+        self.assertEqual(loaded['positive'].sum(), self.parse(history(3))['positive'].sum())
+        # older pandas consolidates the columns into one copied block
+        if tuple(int(part) for part in pd.__version__.split('.')[:2]) >= (1, 5):
+            self.assertIsInstance(loaded['positive'].to_numpy().base, np.memmap)
+
+    def test_torn_append_is_ignored(self):
+        self.store.append(self.parse(history(2)))
+        with open(os.path.join(self.path, 'positive.0.bin'), 'ab') as f:
+            f.write(b'torn')
+        self.assertEqual(len(self.store.load()), 8)
+        self.store.append(self.parse(api_rows(2)))
+        self.assertEqual(state_dates(self.store.load()), state_dates(self.parse(history(3))))
+
+class LateStateTest(SnapshotTestCase):
+
+    def test_state_reporting_late_is_appended(self):
+        client = FakeClient()
+        dataset = StatesDataset(client, snapshot=self.store)
+        client.rows['states/daily.json'] = history(10)
+        dataset.refresh()
+
+        client.rows['states/current.json'] = api_rows(10, ['CA', 'NY']) + api_rows(9, ['WA', 'GU'])
+        dataset.refresh()
+        self.assertIsNotNone(dataset.parent)
+        client.rows['states/current.json'] = api_rows(10)
+        dataset.refresh()
+        # WA and GU add rows to a date the frame already has
+        self.assertIsNone(dataset.parent)
+
+        expected = state_dates(self.parse(history(11)))
+        self.assertEqual(state_dates(dataset.df), expected)
+        self.assertEqual(state_dates(self.store.load()), expected)
+        self.assertEqual(client.requests, ['states/daily.json', 'states/current.json', 'states/current.json'])
+
+    def test_gap_and_interval_download_the_history(self):
+        client = FakeClient()
+        dataset = StatesDataset(client, snapshot=self.store)
+        client.rows['states/daily.json'] = history(10)
+        dataset.refresh()
+        client.rows['states/current.json'] = api_rows(11)
+        client.rows['states/daily.json'] = history(12)
+        dataset.refresh()
+        self.assertEqual(client.requests[-2:], ['states/current.json', 'states/daily.json'])
+
+        client.rows['states/current.json'] = api_rows(12)
+        with mock.patch('plots.plotly_figs.FULL_DOWNLOAD_INTERVAL', -1):
+            dataset.refresh()
+        self.assertEqual(client.requests[-1], 'states/daily.json')
+        self.assertEqual(state_dates(self.store.load()), state_dates(self.parse(history(12))))
+
+if __name__ == '__main__':
+    unittest.main()